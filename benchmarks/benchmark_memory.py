@@ -0,0 +1,77 @@
+"""
+Measures the memory footprint per node of the layertree of a ProjectTopping.
+
+Loads the layertree of a synthetic projecttopping dict (groups of layers with a source, a style and a named style) into LayerTreeItems and measures the Python allocations (tracemalloc) they keep. The results are stored as JSON to compare them between versions:
+
+    python3 benchmarks/benchmark_memory.py --layers 20000 --output new.json --compare old.json
+"""
+import argparse
+import gc
+import json
+import tempfile
+import tracemalloc
+
+from benchmark_serializer import synthetic_projecttopping_dict
+
+from toppingmaker import ProjectTopping, Target
+
+
+def count_nodes(items_list):
+    count = 0
+    for item_dict in items_list:
+        for item_properties_dict in item_dict.values():
+            count += 1 + count_nodes(item_properties_dict.get("child-nodes") or [])
+    return count
+
+
+def run(args):
+    layertree = synthetic_projecttopping_dict(args.layers, args.group_size, 0)[
+        "layertree"
+    ]
+    node_count = count_nodes(layertree)
+    target = Target("benchmark", tempfile.mkdtemp(prefix="toppingmaker_benchmark_"))
+
+    gc.collect()
+    tracemalloc.start()
+    layertree_item = ProjectTopping.LayerTreeItem()
+    layertree_item.load_items_list(layertree, target)
+    gc.collect()
+    memory, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "parameters": {"layers": args.layers, "group_size": args.group_size},
+        "nodes": node_count,
+        "memory_bytes": memory,
+        "peak_memory_bytes": peak_memory,
+        "bytes_per_node": memory / node_count,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--layers", type=int, default=20000)
+    parser.add_argument("--group-size", type=int, default=20)
+    parser.add_argument("--output", help="path of the JSON file to store the results")
+    parser.add_argument("--compare", help="path of a JSON file with baseline results")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        results["bytes_per_node_ratio"] = (
+            results["bytes_per_node"] / baseline["bytes_per_node"]
+        )
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Compares the pure Python and the libyaml-backed YAML serializer on a synthetic projecttopping dict.
+
+    python benchmarks/benchmark_serializer.py --layers 2000 --mapthemes 80
+
+Prints the timings as JSON and if the outputs are byte-identical.
+
+The serializer module is loaded from its file (without the toppingmaker package importing QGIS), so it runs without QGIS.
+"""
+import argparse
+import importlib.util
+import io
+import json
+import os
+import time
+
+
+def load_serializer_module():
+    path = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        os.pardir,
+        "toppingmaker",
+        "serializer.py",
+    )
+    spec = importlib.util.spec_from_file_location("toppingmaker_serializer", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+YamlSerializer = load_serializer_module().YamlSerializer
+
+
+def synthetic_projecttopping_dict(layer_count, group_size, maptheme_count):
+    layertree = []
+    for group_index in range(0, layer_count, group_size):
+        child_nodes = []
+        for layer_index in range(
+            group_index, min(group_index + group_size, layer_count)
+        ):
+            child_nodes.append(
+                {
+                    f"Layer {layer_index}": {
+                        "checked": bool(layer_index % 2),
+                        "expanded": True,
+                        "provider": "ogr",
+                        "uri": f"/home/freddy/qgis_projects/data.gpkg|layername=layer_{layer_index}",
+                        "qmlstylefile": f"freddys_projects/layerstyle/freddys_layer_{layer_index}.qml",
+                        "styles": {
+                            "french": {
+                                "qmlstylefile": f"freddys_projects/layerstyle/freddys_layer_{layer_index}_french.qml"
+                            }
+                        },
+                    }
+                }
+            )
+        layertree.append(
+            {
+                f"Group {group_index}": {
+                    "group": True,
+                    "checked": True,
+                    "expanded": False,
+                    "child-nodes": child_nodes,
+                }
+            }
+        )
+    mapthemes = {}
+    for maptheme_index in range(maptheme_count):
+        mapthemes[f"Theme {maptheme_index}"] = {
+            f"Layer {layer_index}": {
+                "style": "default",
+                "visible": bool((layer_index + maptheme_index) % 3),
+                "expanded": False,
+                "checked_items": [
+                    f"{{{layer_index:08x}-af28-4d88-8092-ee9568ac731f}}",
+                    f"{{{maptheme_index:08x}-d774-46c7-97c7-74ecde13a3ec}}",
+                ],
+            }
+            for layer_index in range(layer_count)
+        }
+    return {
+        "layertree": layertree,
+        "mapthemes": mapthemes,
+        "variables": {"first_variable": "This is a test value."},
+        "layerorder": [f"Layer {layer_index}" for layer_index in range(layer_count)],
+    }
+
+
+def measure(serializer, data, repeat):
+    timings = []
+    for _ in range(repeat):
+        stream = io.StringIO()
+        start = time.perf_counter()
+        serializer.dump(data, stream)
+        timings.append(time.perf_counter() - start)
+    return min(timings), stream.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--layers", type=int, default=600)
+    parser.add_argument("--group-size", type=int, default=20)
+    parser.add_argument("--mapthemes", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    data = synthetic_projecttopping_dict(args.layers, args.group_size, args.mapthemes)
+    python_seconds, python_output = measure(
+        YamlSerializer(use_libyaml=False), data, args.repeat
+    )
+    libyaml_seconds, libyaml_output = measure(
+        YamlSerializer(use_libyaml=True), data, args.repeat
+    )
+    print(
+        json.dumps(
+            {
+                "bytes": len(python_output.encode("utf-8")),
+                "python_seconds": python_seconds,
+                "libyaml_seconds": libyaml_seconds,
+                "speedup": python_seconds / libyaml_seconds,
+                "identical": python_output == libyaml_output,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
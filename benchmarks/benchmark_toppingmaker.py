@@ -0,0 +1,266 @@
+"""
+Benchmark suite of the parse and generate phases of toppingmaker.
+
+Synthesizes a QGIS project with memory layers, nested groups, named styles, map themes and layouts and measures the wall time and peak memory of
+- parse_project
+- _projecttopping_dict
+- generate_files
+- generate_project
+separately. The results are stored as JSON to compare them between versions:
+
+    xvfb-run python3 benchmarks/benchmark_toppingmaker.py --layers 1000 --output new.json --compare old.json
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import tempfile
+import time
+import tracemalloc
+
+from qgis.core import (
+    Qgis,
+    QgsMapThemeCollection,
+    QgsPrintLayout,
+    QgsProject,
+    QgsVectorLayer,
+)
+from qgis.testing import start_app
+
+from toppingmaker import ExportSettings, ProjectTopping, Target
+
+PHASES = ["parse_project", "projecttopping_dict", "generate_files", "generate_project"]
+
+
+def synthetic_project(
+    layer_count, group_depth, group_size, style_count, maptheme_count, layout_count
+):
+    """
+    Returns a project and the export settings exporting the source and all the styles of every layer, all the map themes and all the layouts.
+    """
+    project = QgsProject()
+    export_settings = ExportSettings()
+
+    layers = []
+    for layer_index in range(layer_count):
+        layer = QgsVectorLayer(
+            "point?crs=epsg:4326&field=id:integer&field=name:string",
+            f"Layer {layer_index}",
+            "memory",
+        )
+        style_manager = layer.styleManager()
+        for style_index in range(style_count):
+            layer.setDisplayExpression(f"'Style {style_index}:'||\"name\"")
+            style_manager.addStyleFromLayer(f"style {style_index}")
+            export_settings.set_setting_values(
+                ExportSettings.ToppingType.QMLSTYLE,
+                None,
+                layer.name(),
+                True,
+                None,
+                f"style {style_index}",
+            )
+        style_manager.setCurrentStyle("default")
+        export_settings.set_setting_values(
+            ExportSettings.ToppingType.QMLSTYLE, None, layer.name(), True
+        )
+        export_settings.set_setting_values(
+            ExportSettings.ToppingType.SOURCE, None, layer.name(), True
+        )
+        layers.append(layer)
+    project.addMapLayers(layers, False)
+
+    # the layers are distributed in groups of group_size, every group nested group_depth times
+    for group_index, first_layer_index in enumerate(range(0, layer_count, group_size)):
+        group = project.layerTreeRoot()
+        for depth in range(group_depth):
+            group = group.addGroup(f"Group {group_index}.{depth}")
+        for layer in layers[first_layer_index : first_layer_index + group_size]:
+            group.addLayer(layer)
+
+    for maptheme_index in range(maptheme_count):
+        maptheme_record = QgsMapThemeCollection.MapThemeRecord()
+        for layer_index, layer in enumerate(layers):
+            layerrecord = QgsMapThemeCollection.MapThemeLayerRecord(layer)
+            layerrecord.isVisible = bool((layer_index + maptheme_index) % 2)
+            if style_count:
+                layerrecord.usingCurrentStyle = True
+                layerrecord.currentStyle = f"style {maptheme_index % style_count}"
+            maptheme_record.addLayerRecord(layerrecord)
+        project.mapThemeCollection().insert(f"Theme {maptheme_index}", maptheme_record)
+        export_settings.mapthemes.append(f"Theme {maptheme_index}")
+
+    for layout_index in range(layout_count):
+        layout = QgsPrintLayout(project)
+        layout.initializeDefaults()
+        layout.setName(f"Layout {layout_index}")
+        project.layoutManager().addLayout(layout)
+        export_settings.layouts.append(f"Layout {layout_index}")
+
+    return project, export_settings
+
+
+def measure(function):
+    """
+    Returns the result of the function and the measurement: wall time, peak of the Python allocations (tracemalloc) and the max resident set size of the process after the call.
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {
+        "seconds": seconds,
+        "peak_memory_bytes": peak_memory,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def run(args):
+    project, export_settings = synthetic_project(
+        args.layers,
+        args.group_depth,
+        args.group_size,
+        args.styles,
+        args.mapthemes,
+        args.layouts,
+    )
+    base_dir = tempfile.mkdtemp(prefix="toppingmaker_benchmark_")
+    # only the options not being the default are passed, so older versions can be benchmarked as well
+    parse_options = {}
+    if args.export_workers:
+        parse_options["export_workers"] = args.export_workers
+    if args.direct_streaming:
+        parse_options["direct_streaming"] = args.direct_streaming
+    if args.compact_mapthemes:
+        parse_options["compact_mapthemes"] = args.compact_mapthemes
+    if args.flat_layertree:
+        parse_options["flat_layertree"] = args.flat_layertree
+    target_options = {}
+    if args.storage == "memory":
+        # measure the generation without the filesystem
+        from toppingmaker import MemoryStorage
+
+        target_options["storage"] = MemoryStorage()
+
+    phases = {}
+    for repetition in range(args.repeat):
+        measurements = {}
+
+        project_topping = ProjectTopping()
+        if args.streaming:
+            project_topping.streaming = args.streaming
+        _, measurements["parse_project"] = measure(
+            lambda: project_topping.parse_project(
+                project, export_settings, **parse_options
+            )
+        )
+
+        dict_target = Target(
+            "benchmark", base_dir, f"dict_{repetition}", **target_options
+        )
+        _, measurements["projecttopping_dict"] = measure(
+            lambda: project_topping._projecttopping_dict(dict_target)
+        )
+
+        files_target = Target(
+            "benchmark", base_dir, f"files_{repetition}", **target_options
+        )
+        _, measurements["generate_files"] = measure(
+            lambda: project_topping.generate_files(files_target)
+        )
+
+        _, measurements["generate_project"] = measure(
+            lambda: ProjectTopping().generate_project(files_target)
+        )
+
+        # keep the fastest repetition per phase
+        for phase, measurement in measurements.items():
+            if phase not in phases or measurement["seconds"] < phases[phase]["seconds"]:
+                phases[phase] = measurement
+
+    with open(os.path.join(os.path.dirname(__file__), "..", "VERSION")) as file:
+        toppingmaker_version = file.read().strip()
+
+    return {
+        "toppingmaker_version": toppingmaker_version,
+        "qgis_version": Qgis.QGIS_VERSION,
+        "python_version": platform.python_version(),
+        "parameters": {
+            "layers": args.layers,
+            "group_depth": args.group_depth,
+            "group_size": args.group_size,
+            "styles": args.styles,
+            "mapthemes": args.mapthemes,
+            "layouts": args.layouts,
+            "export_workers": args.export_workers,
+            "direct_streaming": args.direct_streaming,
+            "compact_mapthemes": args.compact_mapthemes,
+            "flat_layertree": args.flat_layertree,
+            "streaming": args.streaming,
+            "storage": args.storage,
+            "repeat": args.repeat,
+        },
+        "phases": phases,
+    }
+
+
+def compare(results, baseline):
+    """
+    Returns per phase the ratio of the time and the peak memory to the baseline (< 1 is faster / smaller).
+    """
+    comparison = {}
+    for phase in PHASES:
+        if phase in results["phases"] and phase in baseline.get("phases", {}):
+            new, old = results["phases"][phase], baseline["phases"][phase]
+            comparison[phase] = {
+                "seconds_ratio": new["seconds"] / old["seconds"]
+                if old["seconds"]
+                else None,
+                "peak_memory_ratio": new["peak_memory_bytes"] / old["peak_memory_bytes"]
+                if old["peak_memory_bytes"]
+                else None,
+            }
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--layers", type=int, default=200)
+    parser.add_argument("--group-depth", type=int, default=2)
+    parser.add_argument("--group-size", type=int, default=20)
+    parser.add_argument("--styles", type=int, default=2, help="named styles per layer")
+    parser.add_argument("--mapthemes", type=int, default=10)
+    parser.add_argument("--layouts", type=int, default=2)
+    parser.add_argument("--export-workers", type=int, default=0)
+    parser.add_argument("--direct-streaming", action="store_true")
+    parser.add_argument("--compact-mapthemes", action="store_true")
+    parser.add_argument("--flat-layertree", action="store_true")
+    parser.add_argument("--streaming", action="store_true")
+    parser.add_argument("--storage", choices=["local", "memory"], default="local")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--output", help="path of the JSON file to store the results")
+    parser.add_argument("--compare", help="path of a JSON file with baseline results")
+    args = parser.parse_args()
+
+    start_app()
+    results = run(args)
+    if args.compare:
+        with open(args.compare) as file:
+            results["comparison"] = compare(results, json.load(file))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -20,20 +20,38 @@
 import datetime
 import logging
 import os
+import sys
 import tempfile
+import zipfile
+from unittest import mock
 
 import yaml
 from qgis.core import (
     Qgis,
     QgsExpressionContextUtils,
+    QgsMapLayer,
     QgsMapThemeCollection,
+    QgsMarkerSymbol,
+    QgsPalLayerSettings,
     QgsPrintLayout,
     QgsProject,
+    QgsRuleBasedRenderer,
     QgsVectorLayer,
+    QgsVectorLayerSimpleLabeling,
 )
+from qgis.PyQt.QtXml import QDomDocument, QDomElement
 from qgis.testing import start_app, unittest
 
-from toppingmaker import ExportSettings, ProjectTopping, Target
+from toppingmaker import (
+    ArchiveStorage,
+    ArchiveTarget,
+    BucketStorage,
+    ExportSettings,
+    MemoryStorage,
+    ProjectTopping,
+    Target,
+    YamlSerializer,
+)
 
 start_app()
 
@@ -58,6 +76,195 @@ class ToppingMakerTest(unittest.TestCase):
             count += 1
         assert count == 4
 
+    def test_target_deduplicate(self):
+        source_dir = tempfile.mkdtemp()
+        filenames = ["cadastral_one.qml", "cadastral_two.qml", "street.qml"]
+        contents = ["<qgis>cadastral</qgis>", "<qgis>cadastral</qgis>", "<qgis/>"]
+        for filename, content in zip(filenames, contents):
+            with open(os.path.join(source_dir, filename), "w") as toppingfile:
+                toppingfile.write(content)
+
+        maindir = os.path.join(self.projecttopping_test_path, "freddys_repository")
+        subdir = "freddys_projects/deduplicated_project"
+        target = Target("freddys", maindir, subdir, deduplicate=True)
+        links = [
+            target.toppingfile_link("layerstyle", os.path.join(source_dir, filename))
+            for filename in filenames
+        ]
+
+        # identical toppingfiles are stored once and linked to the same file
+        assert links[0] == f"{subdir}/layerstyle/freddys_cadastral_one.qml"
+        assert links[1] == links[0]
+        assert links[2] == f"{subdir}/layerstyle/freddys_street.qml"
+        assert len(target.toppingfileinfo_list) == 2
+        assert sorted(os.listdir(os.path.join(maindir, subdir, "layerstyle"))) == [
+            "freddys_cadastral_one.qml",
+            "freddys_street.qml",
+        ]
+
+    def test_target_toppingfile_links(self):
+        source_dir = tempfile.mkdtemp()
+        toppingfiles = []
+        for filename, type in [
+            ("street.qml", "layerstyle"),
+            ("park.qml", "layerstyle"),
+            ("building.qlr", "layerdefinition"),
+            ("overview.qpt", "layouttemplate"),
+        ]:
+            with open(os.path.join(source_dir, filename), "w") as toppingfile:
+                toppingfile.write(f"<{filename}/>")
+            toppingfiles.append((type, os.path.join(source_dir, filename)))
+
+        maindir = os.path.join(self.projecttopping_test_path, "freddys_repository")
+        subdir = "freddys_projects/batched_project"
+        target = Target("freddys", maindir, subdir)
+        with mock.patch("os.makedirs", wraps=os.makedirs) as makedirs:
+            links = target.toppingfile_links(toppingfiles)
+            makedirs_count = makedirs.call_count
+            # the directories are created once per type and not again
+            assert target.filedir_path("layerstyle") == (
+                os.path.join(maindir, subdir, "layerstyle"),
+                os.path.join(subdir, "layerstyle"),
+            )
+            target.toppingfile_links(toppingfiles[:2])
+            assert makedirs.call_count == makedirs_count
+
+        assert links == [
+            f"{subdir}/layerstyle/freddys_street.qml",
+            f"{subdir}/layerstyle/freddys_park.qml",
+            f"{subdir}/layerdefinition/freddys_building.qlr",
+            f"{subdir}/layouttemplate/freddys_overview.qpt",
+        ]
+        assert [info["path"] for info in target.toppingfileinfo_list[:4]] == links
+        for link in links:
+            assert os.path.isfile(os.path.join(maindir, link))
+
+    def test_target_storages(self):
+        source_dir = tempfile.mkdtemp()
+        with open(os.path.join(source_dir, "street.qml"), "w") as toppingfile:
+            toppingfile.write("<qgis/>")
+
+        # in memory nothing is written to the disk
+        memory_storage = MemoryStorage()
+        maindir = os.path.join(self.projecttopping_test_path, "freddys_memory")
+        subdir = "freddys_projects/memory_project"
+        target = Target("freddys", maindir, subdir, storage=memory_storage)
+        link = target.toppingfile_link(
+            "layerstyle", os.path.join(source_dir, "street.qml")
+        )
+        assert link == f"{subdir}/layerstyle/freddys_street.qml"
+        assert not os.path.exists(maindir)
+        assert list(memory_storage.files.values()) == [b"<qgis/>"]
+        linked_toppingfile = target.linked_toppingfile(link)
+        assert linked_toppingfile.filename == "street.qml"
+        assert linked_toppingfile.read() == b"<qgis/>"
+
+        # in the bucket the puts are sent in batches
+        bucket_dir = os.path.join(self.projecttopping_test_path, "freddys_bucket")
+        bucket_storage = BucketStorage(bucket_dir, batch_size=2)
+        target = Target("freddys", "", subdir, storage=bucket_storage)
+        for index in range(5):
+            target.store_file(
+                os.path.join(subdir, "layerstyle", f"style_{index}.qml"),
+                content=f"<qgis>{index}</qgis>".encode(),
+            )
+        assert bucket_storage.batches == 2
+        assert target.file_exists(os.path.join(subdir, "layerstyle", "style_4.qml"))
+        with target:
+            pass
+        assert bucket_storage.batches == 3
+        assert len(os.listdir(os.path.join(bucket_dir, subdir, "layerstyle"))) == 5
+        assert (
+            target.read_file(os.path.join(subdir, "layerstyle", "style_4.qml"))
+            == b"<qgis>4</qgis>"
+        )
+
+        # incremental into the bucket the manifest has the size and mtime of the sent objects
+        bucket_storage = BucketStorage(bucket_dir, batch_size=100)
+        for generation in range(2):
+            target = Target(
+                "freddys", "", subdir, incremental=True, storage=bucket_storage
+            )
+            with mock.patch.object(
+                bucket_storage, "digest", wraps=bucket_storage.digest
+            ) as digest:
+                for index in range(3):
+                    target.store_file(
+                        os.path.join(subdir, "layerdefinition", f"layer_{index}.qlr"),
+                        content=f"<qlr>{index}</qlr>".encode(),
+                    )
+                manifest_report = target.write_manifest()
+                target.close()
+            if generation:
+                # the unchanged objects are not read again
+                assert not digest.called
+                assert len(manifest_report["skipped"]) == 3
+
+        # an archive cannot be incremental and its members are named by the relative paths
+        archive_path = os.path.join(self.projecttopping_test_path, "freddys.zip")
+        with self.assertRaises(ValueError):
+            Target(
+                "freddys",
+                "",
+                subdir,
+                incremental=True,
+                storage=ArchiveStorage(archive_path),
+            )
+        with self.assertRaises(ValueError):
+            Target("freddys", maindir, subdir, storage=ArchiveStorage(archive_path))
+
+    def test_target_incremental(self):
+        source_dir = tempfile.mkdtemp()
+        for filename, content in [
+            ("street.qml", "<qgis/>"),
+            ("park.qml", "<qgis/>"),
+            ("building.qlr", "<qlr/>"),
+        ]:
+            with open(os.path.join(source_dir, filename), "w") as toppingfile:
+                toppingfile.write(content)
+
+        maindir = os.path.join(self.projecttopping_test_path, "freddys_repository")
+        subdir = "freddys_projects/incremental_project"
+        target = Target("freddys", maindir, subdir, incremental=True)
+
+        # first generation writes all files
+        target.toppingfile_link("layerstyle", os.path.join(source_dir, "street.qml"))
+        target.toppingfile_link("layerstyle", os.path.join(source_dir, "park.qml"))
+        target.toppingfile_link(
+            "layerdefinition", os.path.join(source_dir, "building.qlr")
+        )
+        manifest_report = target.write_manifest()
+        assert len(manifest_report["written"]) == 3
+        assert not manifest_report["skipped"]
+        assert not manifest_report["removed"]
+        assert os.path.exists(os.path.join(maindir, subdir, "freddys_manifest.json"))
+
+        # second generation without changes skips all files
+        target.toppingfile_link("layerstyle", os.path.join(source_dir, "street.qml"))
+        target.toppingfile_link("layerstyle", os.path.join(source_dir, "park.qml"))
+        target.toppingfile_link(
+            "layerdefinition", os.path.join(source_dir, "building.qlr")
+        )
+        manifest_report = target.write_manifest()
+        assert not manifest_report["written"]
+        assert len(manifest_report["skipped"]) == 3
+        assert not manifest_report["removed"]
+
+        # third generation with a changed style and without the definition
+        with open(os.path.join(source_dir, "park.qml"), "w") as toppingfile:
+            toppingfile.write("<qgis>park</qgis>")
+        target.toppingfile_link("layerstyle", os.path.join(source_dir, "street.qml"))
+        target.toppingfile_link("layerstyle", os.path.join(source_dir, "park.qml"))
+        manifest_report = target.write_manifest()
+        assert manifest_report["written"] == [f"{subdir}/layerstyle/freddys_park.qml"]
+        assert manifest_report["skipped"] == [f"{subdir}/layerstyle/freddys_street.qml"]
+        assert manifest_report["removed"] == [
+            f"{subdir}/layerdefinition/freddys_building.qlr"
+        ]
+        assert not os.path.exists(
+            os.path.join(maindir, subdir, "layerdefinition", "freddys_building.qlr")
+        )
+
     def test_parse_project(self):
         """
         Parse it without export settings...
@@ -109,6 +316,33 @@ class ToppingMakerTest(unittest.TestCase):
                                 checked_groups.append("Small Group")
         assert checked_groups == ["Big Group", "Medium Group", "Small Group"]
 
+    def test_layer_index(self):
+        """
+        Layers with the same name are found by their layertree node.
+        """
+        project = QgsProject()
+        first_layer = QgsVectorLayer(
+            "point?crs=epsg:4326&field=id:integer", "Strassen", "memory"
+        )
+        second_layer = QgsVectorLayer(
+            "linestring?crs=epsg:4326&field=id:integer", "Strassen", "memory"
+        )
+        project.addMapLayers([first_layer, second_layer], False)
+        project.layerTreeRoot().addGroup("Bern").addLayer(first_layer)
+        project.layerTreeRoot().addGroup("Zuerich").addLayer(second_layer)
+
+        layer_index = ProjectTopping.LayerIndex(project)
+        assert layer_index.layers_by_id[first_layer.id()] == first_layer
+        assert len(layer_index.layers_by_name["Strassen"]) == 2
+        for tree_layer in project.layerTreeRoot().findLayers():
+            assert layer_index.layer_of_node(tree_layer) == tree_layer.layer()
+        assert (
+            layer_index.layer_of_node(
+                project.layerTreeRoot().findGroup("Zuerich").children()[0]
+            )
+            == second_layer
+        )
+
     def test_parse_project_with_mapthemes(self):
         """
         Parse it with export settings defining map themes, variables and layouts
@@ -162,6 +396,241 @@ class ToppingMakerTest(unittest.TestCase):
         # "Layout Two" is in the project but not in the export_settings
         assert "Layout Two" not in layouts
 
+    def test_parse_project_with_compact_mapthemes(self):
+        """
+        With compact map themes only the values differing from the defaults are stored.
+        """
+        project, export_settings = self._make_project_and_export_settings()
+
+        project_topping = ProjectTopping()
+        project_topping.parse_project(project, export_settings)
+        compact_project_topping = ProjectTopping()
+        compact_project_topping.parse_project(
+            project, export_settings, compact_mapthemes=True
+        )
+
+        defaults = ProjectTopping.MapThemes.COMPACT_DEFAULTS
+        mapthemes = project_topping.mapthemes
+        compact_mapthemes = compact_project_topping.mapthemes
+        assert set(compact_mapthemes.keys()) == {"French Theme", "Robot Theme"}
+        for name, maptheme_item in mapthemes.items():
+            assert set(compact_mapthemes[name].keys()) == set(maptheme_item.keys())
+            for record_name, record in maptheme_item.items():
+                if record.get("group"):
+                    assert compact_mapthemes[name][record_name] == record
+                    continue
+                assert compact_mapthemes[name][record_name] == {
+                    key: value
+                    for key, value in record.items()
+                    if key not in defaults or value != defaults[key]
+                }
+        assert compact_mapthemes["Robot Theme"]["Layer One"] == {"style": "robot 1"}
+
+        # the generated map themes are the same
+        maindir = os.path.join(self.projecttopping_test_path, "freddys_repository")
+        target = Target("freddys", maindir, "freddys_projects/compact_mapthemes")
+        compact_project_topping.generate_files(target)
+        generated_project = ProjectTopping().generate_project(target)
+        maptheme_collection = generated_project.mapThemeCollection()
+        for name in ["French Theme", "Robot Theme"]:
+            generated_record = maptheme_collection.mapThemeState(name)
+            original_record = project.mapThemeCollection().mapThemeState(name)
+            assert {
+                (layerrecord.layer().name(), layerrecord.isVisible)
+                for layerrecord in generated_record.layerRecords()
+            } == {
+                (layerrecord.layer().name(), layerrecord.isVisible)
+                for layerrecord in original_record.layerRecords()
+            }
+
+    def test_parse_project_with_export_workers(self):
+        """
+        Parse it serial and with an export pool. The exported toppingfiles need to be identical.
+        """
+        project, export_settings = self._make_project_and_export_settings()
+
+        serial_project_topping = ProjectTopping()
+        serial_project_topping.parse_project(project, export_settings)
+        parallel_project_topping = ProjectTopping()
+        parallel_project_topping.parse_project(
+            project, export_settings, export_workers=4
+        )
+
+        serial_dir = serial_project_topping.layertree.temporary_toppingfile_dir
+        parallel_dir = parallel_project_topping.layertree.temporary_toppingfile_dir
+        filenames = sorted(os.listdir(serial_dir))
+        # 6 qml files, 3 qlr files and 2 qpt files
+        assert len(filenames) == 11
+        assert filenames == sorted(os.listdir(parallel_dir))
+        for filename in filenames:
+            with open(os.path.join(serial_dir, filename), "rb") as serial_file:
+                with open(os.path.join(parallel_dir, filename), "rb") as parallel_file:
+                    assert serial_file.read() == parallel_file.read()
+
+    def test_parse_project_with_failing_layout_export(self):
+        """
+        Parse it with a layout not exported. It's logged and no template file is written.
+        """
+        project, export_settings = self._make_project_and_export_settings()
+
+        project_topping = ProjectTopping()
+        with mock.patch.object(
+            QgsPrintLayout, "writeXml", return_value=QDomElement()
+        ), self.assertLogs(level=logging.WARNING) as logs:
+            project_topping.parse_project(project, export_settings)
+        assert any(
+            "Could not export layout template" in message for message in logs.output
+        )
+        temporary_dir = project_topping.layouts.temporary_toppingfile_dir
+        assert not [
+            filename
+            for filename in os.listdir(temporary_dir)
+            if filename.endswith(".qpt")
+        ]
+
+    def test_parse_project_with_variable_patterns(self):
+        """
+        Parse it with export settings defining the variables by glob patterns
+        """
+        project, export_settings = self._make_project_and_export_settings()
+        export_settings.variables = ["First Variable"]
+        export_settings.variable_patterns = ["Another *", "*Structure"]
+        assert export_settings.variable_keys(
+            ["Another Variable", "First Variable", "Not Exported"]
+        ) == ["First Variable", "Another Variable"]
+
+        project_topping = ProjectTopping()
+        project_topping.parse_project(project, export_settings)
+
+        variables = project_topping.variables
+        assert set(variables.keys()) == {
+            "First Variable",
+            "Another Variable",
+            "Variable with Structure",
+        }
+        assert variables.get("Another Variable") == "2"
+
+    def test_parse_project_with_rules(self):
+        """
+        Parse it with export settings defined by rules (and a setting by name taking precedence)
+        """
+        project, _ = self._make_project_and_export_settings()
+        export_settings = ExportSettings()
+        export_settings.set_setting_values(
+            ExportSettings.ToppingType.QMLSTYLE, None, "Layer Two", False
+        )
+        # all the styles of the layers in the "Big Group" and its subgroups
+        export_settings.add_rule(
+            ExportSettings.ToppingType.QMLSTYLE, group_path="Big Group*", style_name="*"
+        )
+        # the source of the memory layers starting with "Layer T"
+        export_settings.add_rule(
+            ExportSettings.ToppingType.SOURCE, name="Layer T*", provider="memory"
+        )
+        # shadowed by the first rule for all the layers in the "Big Group"
+        export_settings.add_rule(
+            ExportSettings.ToppingType.QMLSTYLE, False, group_path="Big Group/*"
+        )
+        # matching no node
+        export_settings.add_rule(ExportSettings.ToppingType.DEFINITION, name="Layer Z*")
+
+        compiled_settings = export_settings.compile(project)
+        assert compiled_settings.unmatched_rules == export_settings.rules[2:]
+        for node in project.layerTreeRoot().findLayers():
+            for type in ExportSettings.ToppingType:
+                for style_name in [None] + node.layer().styleManager().styles():
+                    assert compiled_settings.get_setting(
+                        type, node, node.name(), style_name
+                    ) == export_settings.get_setting(
+                        type, node, node.name(), style_name
+                    )
+
+        project_topping = ProjectTopping()
+        project_topping.parse_project(project, export_settings)
+
+        checked_layers = []
+        for group_item in project_topping.layertree.items:
+            for item in self._layer_items(group_item):
+                if group_item.name == "Big Group" and item.name != "Layer Two":
+                    assert item.properties.qmlstylefile
+                else:
+                    assert not item.properties.qmlstylefile
+                if item.name in ["Layer One", "Layer Three"]:
+                    assert len(item.properties.styles) == (
+                        2 if group_item.name == "Big Group" else 0
+                    )
+                if item.name in ["Layer Two", "Layer Three"]:
+                    assert item.properties.provider == "memory"
+                else:
+                    assert not item.properties.provider
+                assert not item.properties.definitionfile
+                checked_layers.append(item.name)
+        assert len(checked_layers) == 10
+
+    def _layer_items(self, item):
+        for child in item.items:
+            if child.properties.group:
+                yield from self._layer_items(child)
+            else:
+                yield child
+
+    def test_compile_export_settings(self):
+        """
+        Compile the export settings and check the resolved settings and the keys matching no node
+        """
+        project, export_settings = self._make_project_and_export_settings()
+        # a typo in the name and a style of it
+        export_settings.set_setting_values(
+            ExportSettings.ToppingType.QMLSTYLE, None, "Layer Sevne", True
+        )
+        export_settings.set_setting_values(
+            ExportSettings.ToppingType.QMLSTYLE, None, "Layer Sevne", True, None, "ai"
+        )
+        allofemgroup = project.layerTreeRoot().findGroup("All of em")
+        layer_two_node = allofemgroup.children()[1]
+        # the node key takes precedence over the name key
+        export_settings.set_setting_values(
+            ExportSettings.ToppingType.SOURCE, layer_two_node, None, False
+        )
+
+        compiled_settings = export_settings.compile(project)
+        assert compiled_settings.unmatched_keys == [
+            (ExportSettings.ToppingType.QMLSTYLE, "Layer Sevne"),
+            (ExportSettings.ToppingType.QMLSTYLE, ("Layer Sevne", "ai")),
+        ]
+
+        for node in project.layerTreeRoot().findLayers():
+            for type in ExportSettings.ToppingType:
+                for style_name in [None, "default", "french 1", "robot 3"]:
+                    assert compiled_settings.get_setting(
+                        type, node, node.name(), style_name
+                    ) == export_settings.get_setting(
+                        type, node, node.name(), style_name
+                    )
+
+        biggroup = project.layerTreeRoot().findGroup("Big Group")
+        assert compiled_settings.get_setting(
+            ExportSettings.ToppingType.SOURCE,
+            biggroup.findLayer(layer_two_node.layerId()),
+            "Layer Two",
+        ) == {"export": True}
+        assert compiled_settings.get_setting(
+            ExportSettings.ToppingType.SOURCE, layer_two_node, "Layer Two"
+        ) == {"export": False}
+
+        # the provider of the rules is matched with the layer from the index (here found by the name of the node)
+        export_settings.add_rule(
+            ExportSettings.ToppingType.DEFINITION, provider="memory", name="Layer Two"
+        )
+        layer_index = ProjectTopping.LayerIndex(project)
+        layer_index.layers_by_node = {}
+        compiled_settings = export_settings.compile(project, layer_index)
+        assert compiled_settings.layer_index is layer_index
+        assert not compiled_settings.unmatched_rules
+        assert compiled_settings.get_setting(
+            ExportSettings.ToppingType.DEFINITION, layer_two_node, "Layer Two"
+        ) == {"export": True}
+
     def test_generate_files(self):
         """
         Generate projecttopping file with layertree, map themes, variables and layouts.
@@ -542,6 +1011,820 @@ class ToppingMakerTest(unittest.TestCase):
         # without the projecttopping file they are 20
         assert countchecked == 20
 
+    def test_generate_files_direct_streaming(self):
+        """
+        Generate the toppingfiles without writing them to temporary files. They need to be identical to the copied ones.
+        """
+        project, export_settings = self._make_project_and_export_settings()
+
+        project_topping = ProjectTopping()
+        project_topping.parse_project(project, export_settings)
+        streaming_project_topping = ProjectTopping()
+        streaming_project_topping.parse_project(
+            project, export_settings, direct_streaming=True
+        )
+        # nothing has been written to the temporary directory
+        assert not os.listdir(
+            streaming_project_topping.layertree.temporary_toppingfile_dir
+        )
+
+        maindir = os.path.join(self.projecttopping_test_path, "freddys_repository")
+        target = Target("freddys", maindir, "freddys_projects/copied_project")
+        streaming_target = Target(
+            "freddys", maindir, "freddys_projects/streamed_project"
+        )
+        project_topping.generate_files(target)
+        with mock.patch.object(
+            streaming_target.storage,
+            "make_dir",
+            wraps=streaming_target.storage.make_dir,
+        ) as make_dir:
+            streaming_project_topping.generate_files(streaming_target)
+            # the directories of the four types are created once at the start
+            assert make_dir.call_count == 4
+
+        assert len(streaming_target.toppingfileinfo_list) == 21
+        for toppingfile_type in ["layerstyle", "layerdefinition", "layouttemplate"]:
+            copied_dir, _ = target.filedir_path(toppingfile_type)
+            streamed_dir, _ = streaming_target.filedir_path(toppingfile_type)
+            filenames = sorted(os.listdir(copied_dir))
+            assert filenames == sorted(os.listdir(streamed_dir))
+            for filename in filenames:
+                with open(os.path.join(copied_dir, filename), "rb") as copied_file:
+                    with open(
+                        os.path.join(streamed_dir, filename), "rb"
+                    ) as streamed_file:
+                        assert copied_file.read() == streamed_file.read()
+
+    def test_parse_project_flat_layertree(self):
+        """
+        The flat layertree results in the same projecttopping and handles trees deeper than the recursion limit.
+        """
+        project, export_settings = self._make_project_and_export_settings()
+        maindir = os.path.join(self.projecttopping_test_path, "freddys_repository")
+
+        yamls = []
+        for subdir, flat_layertree in [
+            ("freddys_projects/nested_layertree", False),
+            ("freddys_projects/flat_layertree", True),
+        ]:
+            project_topping = ProjectTopping()
+            project_topping.parse_project(
+                project, export_settings, flat_layertree=flat_layertree
+            )
+            target = Target("freddys", maindir, subdir)
+            projecttopping_file_path = os.path.join(
+                maindir, project_topping.generate_files(target)
+            )
+            with open(projecttopping_file_path) as yamlfile:
+                yamls.append(yamlfile.read().replace(subdir, "freddys_projects"))
+        assert isinstance(project_topping.layertree, ProjectTopping.FlatLayerTree)
+        assert yamls[0] == yamls[1]
+        assert [item.name for item in project_topping.layertree.items] == [
+            "Big Group",
+            "All of em",
+        ]
+
+        # a tree deeper than the recursion limit
+        deep_project = QgsProject()
+        group = deep_project.layerTreeRoot()
+        depth = sys.getrecursionlimit() + 100
+        for level in range(depth):
+            group = group.addGroup(f"Level {level}")
+        project_topping = ProjectTopping()
+        project_topping.parse_project(deep_project, flat_layertree=True)
+        assert len(project_topping.layertree) == depth
+        assert project_topping.layertree.parents == list(range(-1, depth - 1))
+        target = Target("freddys", maindir, "freddys_projects/deep_layertree")
+        item_dict = project_topping.layertree.items_list(target)[0]
+        for level in range(depth - 1):
+            item_dict = item_dict[f"Level {level}"]["child-nodes"][0]
+        assert item_dict == {
+            f"Level {depth - 1}": {"group": True, "checked": True, "expanded": True}
+        }
+
+        # and it's generated to a project and loaded without recursion as well
+        generated_project = project_topping.generate_project()
+        group = generated_project.layerTreeRoot()
+        for level in range(depth):
+            assert len(group.children()) == 1
+            group = group.children()[0]
+            assert group.name() == f"Level {level}"
+        projecttopping_file_path = os.path.join(
+            maindir, project_topping.generate_files(target)
+        )
+        with open(projecttopping_file_path) as projecttopping_file:
+            projecttopping_content = projecttopping_file.read()
+        assert projecttopping_content.count("child-nodes:") == depth - 1
+        for level in range(depth):
+            assert f"Level {level}:" in projecttopping_content
+        if yaml.__with_libyaml__:
+            # the pure Python loader composes the nodes recursively
+            loaded_project_topping = ProjectTopping()
+            assert loaded_project_topping.load_files(target, flat_layertree=True)
+            assert isinstance(
+                loaded_project_topping.layertree, ProjectTopping.FlatLayerTree
+            )
+            assert loaded_project_topping.layertree.parents == list(
+                range(-1, depth - 1)
+            )
+
+    def test_generate_files_streaming(self):
+        """
+        The streamed projecttopping file is the same as the dumped projecttopping dict (with the nested and the flat layertree).
+        """
+        project, export_settings = self._make_project_and_export_settings()
+        maindir = os.path.join(self.projecttopping_test_path, "freddys_repository")
+
+        yamls = []
+        toppingfile_paths = []
+        for subdir, flat_layertree, streaming in [
+            ("freddys_projects/dumped", False, False),
+            ("freddys_projects/streamed", False, True),
+            ("freddys_projects/streamed_flat", True, True),
+        ]:
+            project_topping = ProjectTopping()
+            project_topping.streaming = streaming
+            project_topping.parse_project(
+                project, export_settings, flat_layertree=flat_layertree
+            )
+            target = Target("freddys", maindir, subdir)
+            projecttopping_file_path = os.path.join(
+                maindir, project_topping.generate_files(target)
+            )
+            with open(projecttopping_file_path) as yamlfile:
+                yamls.append(yamlfile.read().replace(subdir, "freddys_projects"))
+            # the toppingfiles are stored in the same order
+            toppingfile_paths.append(
+                [
+                    info["path"].replace(subdir, "freddys_projects")
+                    for info in target.toppingfileinfo_list
+                ]
+            )
+        assert yamls[0] == yamls[1]
+        assert toppingfile_paths[0] == toppingfile_paths[1]
+        assert yamls[0] == yamls[2]
+        assert toppingfile_paths[0] == toppingfile_paths[2]
+
+    def test_compact_layertree_items(self):
+        """
+        The items and properties have no dict per node and their styles and child items are only created when needed.
+        """
+        project, export_settings = self._make_project_and_export_settings()
+        project_topping = ProjectTopping()
+        project_topping.parse_project(project, export_settings)
+
+        layer_items = []
+        items = list(project_topping.layertree.items)
+        while items:
+            item = items.pop()
+            assert not hasattr(item, "__dict__")
+            assert not hasattr(item.properties, "__dict__")
+            # the private list, since the items property creates it
+            items.extend(item._items or [])
+            if not item.properties.group:
+                layer_items.append(item)
+
+        # the layers without child items and styles have none created
+        assert all(item._items is None for item in layer_items)
+
+        # and writing the items does not create them
+        target = Target("freddys", self.projecttopping_test_path, "compact")
+        project_topping.layertree.items_list(target)
+        list(project_topping.layertree.walk_items(target))
+        assert all(item._items is None for item in layer_items)
+        unstyled_items = [
+            item for item in layer_items if not item.properties.has_styles
+        ]
+        assert unstyled_items
+        for item in unstyled_items:
+            assert item.properties._styles is None
+
+        # the styles and the child items are created with the first one or when they are accessed
+        properties = ProjectTopping.TreeItemProperties()
+        style_properties = ProjectTopping.TreeItemProperties.StyleItemProperties()
+        properties.add_style("french", style_properties)
+        assert properties.styles == {"french": style_properties}
+        unstyled_items[0].properties.styles["french"] = style_properties
+        assert unstyled_items[0].properties.has_styles
+        child_item = ProjectTopping.LayerTreeItem()
+        layer_items[0].items.append(child_item)
+        assert layer_items[0].items == [child_item]
+
+    def test_temporary_storage(self):
+        """
+        Parse it into one temporary directory shared by all the items and removed when leaving the context
+        """
+        project, export_settings = self._make_project_and_export_settings()
+
+        with ProjectTopping() as project_topping:
+            project_topping.parse_project(project, export_settings)
+            temporary_storage = project_topping.temporary_storage
+            temporary_dir = temporary_storage.directory
+            assert project_topping.layertree.items[0].temporary_storage is (
+                temporary_storage
+            )
+            assert project_topping.layouts.temporary_storage is temporary_storage
+            # 6 styles, 3 definitions and 2 layout templates (the layers multiple times in the tree have the same temporary files)
+            assert len(temporary_storage.paths) == 11
+            assert sorted(os.listdir(temporary_dir)) == sorted(
+                os.path.basename(path) for path in temporary_storage.paths
+            )
+
+            maindir = os.path.join(self.projecttopping_test_path, "freddys_repository")
+            target = Target("freddys", maindir, "freddys_projects/temporary_project")
+            project_topping.generate_files(target)
+        assert not os.path.exists(temporary_dir)
+        assert not temporary_storage.paths
+
+    def test_parse_project_with_same_layer_names(self):
+        """
+        Parse it with two different layers with the same name in different groups. Their toppingfiles need to have different names.
+        """
+        project, export_settings = self._make_project_and_export_settings()
+        street_layers = []
+        for group_name in ["Town", "Country"]:
+            layer = QgsVectorLayer(
+                "linestring?crs=epsg:4326&field=id:integer", "Strassen", "memory"
+            )
+            project.addMapLayer(layer, False)
+            project.layerTreeRoot().addGroup(group_name).addLayer(layer)
+            street_layers.append(layer)
+        export_settings.set_setting_values(
+            ExportSettings.ToppingType.QMLSTYLE, None, "Strassen", True
+        )
+        export_settings.set_setting_values(
+            ExportSettings.ToppingType.DEFINITION, None, "Strassen", True
+        )
+
+        project_topping = ProjectTopping()
+        project_topping.parse_project(project, export_settings)
+        street_items = [
+            group_item.items[0]
+            for group_item in project_topping.layertree.items
+            if group_item.name in ["Town", "Country"]
+        ]
+        assert [
+            os.path.basename(item.properties.qmlstylefile) for item in street_items
+        ] == ["town_strassen.qml", "country_strassen.qml"]
+        assert [
+            os.path.basename(item.properties.definitionfile) for item in street_items
+        ] == ["town_strassen.qlr", "country_strassen.qlr"]
+
+        # the filenames do not depend on the order of the layers
+        root = project.layerTreeRoot()
+        country_group = root.findGroup("Country")
+        root.insertChildNode(0, country_group.clone())
+        root.removeChildNode(country_group)
+        reordered_project_topping = ProjectTopping()
+        reordered_project_topping.parse_project(project, export_settings)
+        reordered_street_items = [
+            group_item.items[0]
+            for group_item in reordered_project_topping.layertree.items
+            if group_item.name in ["Town", "Country"]
+        ]
+        assert [
+            os.path.basename(item.properties.qmlstylefile)
+            for item in reordered_street_items
+        ] == ["country_strassen.qml", "town_strassen.qml"]
+
+        maindir = os.path.join(self.projecttopping_test_path, "freddys_repository")
+        target = Target("freddys", maindir, "freddys_projects/same_names_project")
+        project_topping.generate_files(target)
+        layerstyle_dir, _ = target.filedir_path("layerstyle")
+        assert {"freddys_town_strassen.qml", "freddys_country_strassen.qml"} <= set(
+            os.listdir(layerstyle_dir)
+        )
+
+    def test_parse_project_named_styles(self):
+        """
+        Parse the named styles without making them current and compare them with the ones exported as current style (with all and with some categories).
+        """
+        project, export_settings = self._make_project_and_export_settings()
+        layer = project.mapLayersByName("Layer One")[0]
+        symbology_categories = (
+            QgsMapLayer.StyleCategory.Symbology | QgsMapLayer.StyleCategory.Labeling
+        )
+        export_settings.set_setting_values(
+            ExportSettings.ToppingType.QMLSTYLE,
+            None,
+            "Layer One",
+            True,
+            symbology_categories,
+            "robot 1",
+        )
+        style_changes = []
+        layer.styleManager().currentStyleChanged.connect(style_changes.append)
+
+        project_topping = ProjectTopping()
+        project_topping.parse_project(project, export_settings)
+        # only the style with some categories has been made current (and the default restored) - once for both nodes of the layer
+        assert style_changes == ["robot 1", "default"]
+        assert layer.styleManager().currentStyle() == "default"
+        layer_one_items = []
+        items = list(project_topping.layertree.items)
+        while items:
+            item = items.pop()
+            items.extend(item._items or [])
+            if item.name == "Layer One":
+                layer_one_items.append(item)
+        assert len(layer_one_items) == 2
+        assert (
+            layer_one_items[0].properties.styles["robot 1"].qmlstylefile
+            == layer_one_items[1].properties.styles["robot 1"].qmlstylefile
+        )
+
+        layer_one_item = project_topping.layertree.items[0].items[0]
+        assert layer_one_item.name == "Layer One"
+        for style_name, categories in [
+            ("french 1", QgsMapLayer.StyleCategory.AllStyleCategories),
+            ("robot 1", symbology_categories),
+        ]:
+            with open(
+                layer_one_item.properties.styles[style_name].qmlstylefile, "rb"
+            ) as qmlstylefile:
+                document = QDomDocument()
+                document.setContent(qmlstylefile.read())
+            layer.styleManager().setCurrentStyle(style_name)
+            expected_document = QDomDocument()
+            layer.exportNamedStyle(expected_document, categories=categories)
+            layer.styleManager().setCurrentStyle("default")
+
+            root = document.documentElement()
+            expected_root = expected_document.documentElement()
+            assert self._child_element_names(root) == self._child_element_names(
+                expected_root
+            )
+            assert root.attribute("styleCategories") == expected_root.attribute(
+                "styleCategories"
+            )
+            assert root.firstChildElement("previewExpression").text() == (
+                expected_root.firstChildElement("previewExpression").text()
+            )
+
+    def test_parse_project_named_styles_differing_from_current(self):
+        """
+        Parse a named style with another renderer and labeling than the current style and check that the elements of the categories not requested are not exported.
+        """
+        project, export_settings = self._make_project_and_export_settings()
+        layer = project.mapLayersByName("Layer One")[0]
+        style_manager = layer.styleManager()
+        layer.setRenderer(QgsRuleBasedRenderer(QgsMarkerSymbol.createSimple({})))
+        layer.setLabeling(QgsVectorLayerSimpleLabeling(QgsPalLayerSettings()))
+        layer.setLabelsEnabled(True)
+        style_manager.addStyleFromLayer("labeled")
+        style_manager.setCurrentStyle("default")
+        assert not layer.labelsEnabled()
+
+        for style_name, categories in [
+            ("labeled", QgsMapLayer.StyleCategory.Fields),
+            ("french 1", QgsMapLayer.StyleCategory.Fields),
+        ]:
+            export_settings.set_setting_values(
+                ExportSettings.ToppingType.QMLSTYLE,
+                None,
+                "Layer One",
+                True,
+                categories,
+                style_name,
+            )
+        project_topping = ProjectTopping()
+        project_topping.parse_project(project, export_settings)
+        assert layer.styleManager().currentStyle() == "default"
+        assert layer.renderer().type() != "RuleRenderer"
+
+        layer_one_item = project_topping.layertree.items[0].items[0]
+        with open(
+            layer_one_item.properties.styles["labeled"].qmlstylefile, "rb"
+        ) as qmlstylefile:
+            document = QDomDocument()
+            document.setContent(qmlstylefile.read())
+        element_names = self._child_element_names(document.documentElement())
+        assert "labeling" not in element_names
+        assert "renderer-v2" not in element_names
+        assert "aliases" in element_names
+
+        # with the symbology and the labeling the ones of the named style are exported
+        export_settings.set_setting_values(
+            ExportSettings.ToppingType.QMLSTYLE,
+            None,
+            "Layer One",
+            True,
+            QgsMapLayer.StyleCategory.Symbology | QgsMapLayer.StyleCategory.Labeling,
+            "labeled",
+        )
+        project_topping.parse_project(project, export_settings)
+        layer_one_item = project_topping.layertree.items[0].items[0]
+        with open(
+            layer_one_item.properties.styles["labeled"].qmlstylefile, "rb"
+        ) as qmlstylefile:
+            document = QDomDocument()
+            document.setContent(qmlstylefile.read())
+        root = document.documentElement()
+        assert root.firstChildElement("labeling").attribute("type") == "simple"
+        assert root.firstChildElement("renderer-v2").attribute("type") == "RuleRenderer"
+        assert layer.styleManager().currentStyle() == "default"
+
+    def _child_element_names(self, element):
+        names = []
+        child = element.firstChildElement()
+        while not child.isNull():
+            names.append(child.tagName())
+            child = child.nextSiblingElement()
+        return names
+
+    def test_parse_project_with_profiling(self):
+        """
+        Parse and generate with profiling and check the report of the phases, nodes and written bytes.
+        """
+        project, export_settings = self._make_project_and_export_settings()
+
+        project_topping = ProjectTopping()
+        project_topping.profiling = True
+        project_topping.profiling_stream = True
+        messages = []
+        project_topping.stdout.connect(lambda text, level: messages.append(text))
+        project_topping.parse_project(project, export_settings)
+
+        maindir = os.path.join(self.projecttopping_test_path, "freddys_repository")
+        target = Target("freddys", maindir, "freddys_projects/profiled_project")
+        project_topping.generate_files(target)
+
+        report = project_topping.profiling_report
+        for phase in [
+            "parse.layertree",
+            "parse.mapthemes",
+            "parse.layouts",
+            "generate.projecttopping_dict",
+            "generate.serialization",
+        ]:
+            assert phase in report.phases
+            assert any(message.startswith(f"{phase}: ") for message in messages)
+        # the exports per file are summed up in the report (and its summary) but not emitted one by one
+        for phase in ["parse.layerstyle", "parse.layerdefinition"]:
+            assert report.phases[phase] > 0
+            assert not any(message.startswith(f"{phase}: ") for message in messages)
+            assert f"\n{phase}: " in report.summary()
+        for toppingfile_type in [
+            "layerstyle",
+            "layerdefinition",
+            "layouttemplate",
+            "projecttopping",
+        ]:
+            assert report.bytes[toppingfile_type] > 0
+        slowest_layers = report.slowest_layers(3)
+        assert len(slowest_layers) == 3
+        assert not any(node["group"] for node in slowest_layers)
+        assert (
+            slowest_layers[0]["seconds"]
+            >= slowest_layers[1]["seconds"]
+            >= slowest_layers[2]["seconds"]
+        )
+        assert "Big Group" in [node["name"] for node in report.nodes]
+
+        # without profiling nothing is measured
+        unprofiled_project_topping = ProjectTopping()
+        unprofiled_project_topping.parse_project(project, export_settings)
+        assert unprofiled_project_topping.profiling_report is None
+
+    def test_yaml_serializer(self):
+        """
+        The libyaml-backed and the pure Python serializer need to write the same YAML.
+        """
+        project, export_settings = self._make_project_and_export_settings()
+        project_topping = ProjectTopping()
+        project_topping.parse_project(project, export_settings)
+
+        maindir = os.path.join(self.projecttopping_test_path, "freddys_repository")
+        target = Target("freddys", maindir, "freddys_projects/serialized_project")
+        projecttopping_dict = project_topping._projecttopping_dict(target)
+
+        python_yaml = YamlSerializer(use_libyaml=False).dump(projecttopping_dict)
+        libyaml_yaml = YamlSerializer(use_libyaml=True).dump(projecttopping_dict)
+        assert python_yaml == libyaml_yaml
+        assert yaml.safe_load(libyaml_yaml) == projecttopping_dict
+
+    def test_generate_files_concurrently(self):
+        project, export_settings = self._make_project_and_export_settings()
+        project_toppings = []
+        for _ in range(6):
+            project_topping = ProjectTopping()
+            project_topping.parse_project(project, export_settings)
+            project_toppings.append(project_topping)
+
+        # all in one repository
+        maindir = os.path.join(self.projecttopping_test_path, "freddys_repository")
+        subdir = "freddys_projects/concurrent_projects"
+        targets = [Target(f"freddys_{index}", maindir, subdir) for index in range(6)]
+
+        links = ProjectTopping.generate_files_concurrently(
+            list(zip(project_toppings, targets)), workers=4
+        )
+        assert links == [
+            f"{subdir}/projecttopping/freddys_{index}.yaml" for index in range(6)
+        ]
+        for target in targets:
+            assert len(target.toppingfileinfo_list) == 21
+        for link in links:
+            with open(os.path.join(maindir, link)) as yamlfile:
+                assert "layertree" in yaml.safe_load(yamlfile)
+        # the files are written atomically without leftovers
+        for dirpath, _, filenames in os.walk(os.path.join(maindir, subdir)):
+            assert not [filename for filename in filenames if filename.endswith(".tmp")]
+
+        # the same target or the same projecttopping file is not generated twice
+        shared_target = Target("freddys_shared", maindir, subdir)
+        with self.assertRaises(ValueError):
+            ProjectTopping.generate_files_concurrently(
+                [
+                    (project_toppings[0], shared_target),
+                    (project_toppings[1], shared_target),
+                ]
+            )
+        with self.assertRaises(ValueError):
+            ProjectTopping.generate_files_concurrently(
+                [
+                    (project_toppings[0], Target("freddys_shared", maindir, subdir)),
+                    (project_toppings[1], Target("freddys_shared", maindir, subdir)),
+                ]
+            )
+        # and the same ProjectTopping is not generated by two threads at once
+        with self.assertRaises(ValueError):
+            ProjectTopping.generate_files_concurrently(
+                [
+                    (project_toppings[0], Target("freddys_first", maindir, subdir)),
+                    (project_toppings[0], Target("freddys_second", maindir, subdir)),
+                ]
+            )
+
+    def test_generate_files_failing(self):
+        """
+        A generation failing while the projecttopping file is written keeps the file of the previous generation.
+        """
+        project, export_settings = self._make_project_and_export_settings()
+        project_topping = ProjectTopping()
+        project_topping.parse_project(project, export_settings)
+
+        maindir = os.path.join(self.projecttopping_test_path, "freddys_repository")
+        subdir = "freddys_projects/failing_project"
+        target = Target("freddys", maindir, subdir)
+        projecttopping_file_path = os.path.join(
+            maindir, project_topping.generate_files(target)
+        )
+        with open(projecttopping_file_path) as projecttopping_file:
+            projecttopping_content = projecttopping_file.read()
+
+        def failing_dump(target, projecttopping_dict, stream):
+            stream.write("layertree:\n")
+            raise RuntimeError("failed in the middle of the dump")
+
+        with mock.patch.object(
+            project_topping, "_dump_projecttopping", side_effect=failing_dump
+        ):
+            with self.assertRaises(RuntimeError):
+                project_topping.generate_files(Target("freddys", maindir, subdir))
+
+        with open(projecttopping_file_path) as projecttopping_file:
+            assert projecttopping_file.read() == projecttopping_content
+        projecttopping_dir = os.path.dirname(projecttopping_file_path)
+        assert not [
+            filename
+            for filename in os.listdir(projecttopping_dir)
+            if filename.endswith(".tmp")
+        ]
+
+    def test_load_files(self):
+        """
+        Load the generated files into a ProjectTopping and generate them again to another target. The result needs to be the same.
+        """
+        project, export_settings = self._make_project_and_export_settings()
+        project_topping = ProjectTopping()
+        project_topping.parse_project(project, export_settings)
+
+        maindir = os.path.join(self.projecttopping_test_path, "freddys_repository")
+        subdir = "freddys_projects/loaded_project"
+        target = Target("freddys", maindir, subdir)
+        projecttopping_file_path = os.path.join(
+            maindir, project_topping.generate_files(target)
+        )
+
+        loaded_project_topping = ProjectTopping()
+        assert loaded_project_topping.load_files(target)
+
+        # the structure is loaded
+        assert [item.name for item in loaded_project_topping.layertree.items] == [
+            "Big Group",
+            "All of em",
+        ]
+        assert dict(loaded_project_topping.mapthemes) == dict(project_topping.mapthemes)
+        assert dict(loaded_project_topping.variables) == dict(project_topping.variables)
+        assert set(loaded_project_topping.layouts.keys()) == {
+            "Layout One",
+            "Layout Three",
+        }
+        # the toppingfiles are linked but not read
+        layout_templatefile = loaded_project_topping.layouts["Layout One"][
+            "templatefile"
+        ]
+        assert layout_templatefile.filename == "layout_one.qpt"
+        assert layout_templatefile.path == os.path.join(
+            maindir, subdir, "layouttemplate", "freddys_layout_one.qpt"
+        )
+
+        # generating the loaded topping results in the same files
+        regenerated_subdir = "freddys_projects/regenerated_project"
+        regenerated_target = Target("freddys", maindir, regenerated_subdir)
+        regenerated_projecttopping_file_path = os.path.join(
+            maindir, loaded_project_topping.generate_files(regenerated_target)
+        )
+        with open(projecttopping_file_path) as yamlfile:
+            projecttopping_yaml = yamlfile.read()
+        with open(regenerated_projecttopping_file_path) as yamlfile:
+            regenerated_projecttopping_yaml = yamlfile.read()
+        assert regenerated_projecttopping_yaml == projecttopping_yaml.replace(
+            subdir, regenerated_subdir
+        )
+        assert len(regenerated_target.toppingfileinfo_list) == 21
+
+    def test_mapthemes_delta(self):
+        """
+        Write the map themes as base and deltas and load them expanded again.
+        """
+        project, export_settings = self._make_project_and_export_settings()
+        project_topping = ProjectTopping()
+        project_topping.parse_project(project, export_settings)
+        project_topping.mapthemes_delta = True
+
+        maindir = os.path.join(self.projecttopping_test_path, "freddys_repository")
+        target = Target("freddys", maindir, "freddys_projects/mapthemes_delta")
+        projecttopping_file_path = os.path.join(
+            maindir, project_topping.generate_files(target)
+        )
+        with open(projecttopping_file_path) as yamlfile:
+            projecttopping_data = yaml.safe_load(yamlfile)
+        assert "mapthemes" not in projecttopping_data
+        mapthemes_delta = projecttopping_data["mapthemes-delta"]
+        assert set(mapthemes_delta["themes"].keys()) == {"French Theme", "Robot Theme"}
+        # the themes contain only the records differing from the base
+        for theme in mapthemes_delta["themes"].values():
+            for record_name, record in theme.get("records", {}).items():
+                assert mapthemes_delta["base"].get(record_name) != record
+
+        loaded_project_topping = ProjectTopping()
+        assert loaded_project_topping.load_files(target)
+        assert dict(loaded_project_topping.mapthemes) == dict(project_topping.mapthemes)
+
+    def test_generate_project(self):
+        """
+        Generate a QGIS project from the generated files.
+        """
+        project, export_settings = self._make_project_and_export_settings()
+        project_topping = ProjectTopping()
+        project_topping.parse_project(project, export_settings)
+
+        maindir = os.path.join(self.projecttopping_test_path, "freddys_repository")
+        target = Target("freddys", maindir, "freddys_projects/generated_project")
+        project_topping.generate_files(target)
+
+        generated_project = ProjectTopping().generate_project(target)
+
+        # check layertree
+        root = generated_project.layerTreeRoot()
+        assert [node.name() for node in root.children()] == ["Big Group", "All of em"]
+        big_group = root.findGroup("Big Group")
+        assert [node.name() for node in big_group.children()] == [
+            "Layer One",
+            "Medium Group",
+        ]
+        assert [
+            node.name() for node in big_group.findGroup("Small Group").children()
+        ] == ["Layer Three", "Layer Four"]
+        all_of_em_group = root.findGroup("All of em")
+        assert [node.name() for node in all_of_em_group.children()] == [
+            "Layer One",
+            "Layer Two",
+            "Layer Three",
+            "Layer Four",
+            "Layer Five",
+        ]
+        assert not all_of_em_group.children()[0].itemVisibilityChecked()
+        assert all_of_em_group.children()[1].itemVisibilityChecked()
+
+        # layers created from source are created once and get their styles
+        layer_one_layers = generated_project.mapLayersByName("Layer One")
+        assert len(layer_one_layers) == 1
+        assert set(layer_one_layers[0].styleManager().styles()) == {
+            "default",
+            "french 1",
+            "robot 1",
+        }
+        assert layer_one_layers[0].styleManager().currentStyle() == "default"
+
+        # check mapthemes
+        maptheme_collection = generated_project.mapThemeCollection()
+        assert set(maptheme_collection.mapThemes()) == {"French Theme", "Robot Theme"}
+        robot_record = maptheme_collection.mapThemeState("Robot Theme")
+        assert len(robot_record.layerRecords()) == 2
+        assert set(robot_record.expandedGroupNodes()) == {"Small Group", "Big Group"}
+
+        # check variables
+        assert (
+            QgsExpressionContextUtils.projectScope(generated_project).variable(
+                "First Variable"
+            )
+            == "This is a test value."
+        )
+
+        # check layouts
+        assert {
+            layout.name() for layout in generated_project.layoutManager().printLayouts()
+        } == {"Layout One", "Layout Three"}
+
+        # the flat layertree generates the same layertree
+        flat_project_topping = ProjectTopping()
+        flat_project_topping.load_files(target, flat_layertree=True)
+        flat_generated_project = flat_project_topping.generate_project()
+        assert self._layertree_states(
+            flat_generated_project.layerTreeRoot()
+        ) == self._layertree_states(root)
+
+    def _layertree_states(self, group):
+        return [
+            (
+                node.name(),
+                node.itemVisibilityChecked(),
+                node.isExpanded(),
+                self._layertree_states(node) if node.children() else None,
+            )
+            for node in group.children()
+        ]
+
+    def test_archive_target(self):
+        """
+        Generate the files into one archive and load them again from the archive.
+        """
+        project, export_settings = self._make_project_and_export_settings()
+        project_topping = ProjectTopping()
+        project_topping.parse_project(project, export_settings)
+
+        archive_path = os.path.join(
+            self.projecttopping_test_path, "freddys_archive", "freddys.zip"
+        )
+        target = ArchiveTarget("freddys", archive_path, "freddys_projects/archived")
+        projecttopping_link = project_topping.generate_files(target)
+
+        # everything is in the archive and the links are the members
+        with zipfile.ZipFile(archive_path) as archive:
+            members = archive.namelist()
+            projecttopping_dict = yaml.safe_load(archive.read(projecttopping_link))
+        assert projecttopping_link in members
+        assert len(members) == len(set(members))
+        assert len(target.toppingfileinfo_list) == 21
+        assert {
+            toppingfileinfo["path"] for toppingfileinfo in target.toppingfileinfo_list
+        } == set(members)
+        for node in projecttopping_dict["layertree"]:
+            if "All of em" in node:
+                for childnode in node["All of em"]["child-nodes"]:
+                    for properties in childnode.values():
+                        if "qmlstylefile" in properties:
+                            assert properties["qmlstylefile"] in members
+
+        # streamed the toppingfiles are stored while the projecttopping file is generated
+        streaming_archive_path = os.path.join(
+            self.projecttopping_test_path, "freddys_archive", "freddys_streamed.zip"
+        )
+        streaming_target = ArchiveTarget(
+            "freddys", streaming_archive_path, "freddys_projects/archived"
+        )
+        project_topping.streaming = True
+        assert project_topping.generate_files(streaming_target) == projecttopping_link
+        project_topping.streaming = False
+        with zipfile.ZipFile(streaming_archive_path) as archive:
+            assert sorted(archive.namelist()) == sorted(members)
+            assert (
+                yaml.safe_load(archive.read(projecttopping_link)) == projecttopping_dict
+            )
+
+        # loaded from the archive the toppingfiles are read when accessed
+        loaded_project_topping = ProjectTopping()
+        assert loaded_project_topping.load_files(target)
+        layout_templatefile = loaded_project_topping.layouts["Layout One"][
+            "templatefile"
+        ]
+        assert layout_templatefile.filename == "layout_one.qpt"
+        assert layout_templatefile.path is None
+        assert b"<Layout" in layout_templatefile.read()
+
+        generated_project = loaded_project_topping.generate_project(target)
+        assert [
+            node.name() for node in generated_project.layerTreeRoot().children()
+        ] == ["Big Group", "All of em"]
+        assert {
+            layout.name() for layout in generated_project.layoutManager().printLayouts()
+        } == {"Layout One", "Layout Three"}
+        target.close()
+
     def test_custom_path_resolver(self):
         # load QGIS project into structure
         project_topping = ProjectTopping()
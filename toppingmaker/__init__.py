@@ -16,6 +16,9 @@
  *                                                                         *
  ***************************************************************************/
 """
+from .archivetarget import ArchiveTarget
 from .exportsettings import ExportSettings
 from .projecttopping import ProjectTopping
+from .serializer import Serializer, YamlSerializer
+from .storage import ArchiveStorage, BucketStorage, LocalStorage, MemoryStorage, Storage
 from .target import Target
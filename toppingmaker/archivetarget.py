@@ -0,0 +1,65 @@
+"""
+/***************************************************************************
+                              -------------------
+        begin                : 2022-07-17
+        git sha              : :%H$
+        copyright            : (C) 2022 by Dave Signer
+        email                : david at opengis ch
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import zipfile
+
+from .storage import ArchiveStorage
+from .target import Target
+
+
+class ArchiveTarget(Target):
+    """
+    A target writing the whole topping (projecttopping file, styles, definitions and layout templates) into one zip archive at `archive_path`.
+
+    The files are written one after the other as archive members (streamed, without temporary copies). The structure in the archive is the same as the one in the main_dir of a Target:
+    <archive>
+    ├── <subdir>
+    │  ├── projecttopping
+    │  │  └── <projectname>.yaml
+    │  ├── layerstyle
+    │  │  └── <projectname>_<layername>.qml
+    │  └── layerdefinition
+    │  │  └── <projectname>_<layername>.qlr
+
+    So the links in the projecttopping file are the names of the archive members.
+    The archive is finished with `close()` (called by `generate_files`). When reading it back (`load_files`) only the members being accessed are decompressed.
+
+    The files are stored with an `ArchiveStorage`. `incremental` is not supported by an archive.
+    """
+
+    def __init__(
+        self,
+        projectname: str = "project",
+        archive_path: str = None,
+        sub_dir: str = None,
+        path_resolver=None,
+        deduplicate: bool = False,
+        compression: int = zipfile.ZIP_DEFLATED,
+        compresslevel: int = None,
+    ):
+        # the paths in the target are the names of the archive members
+        Target.__init__(
+            self,
+            projectname,
+            "",
+            sub_dir or "",
+            path_resolver,
+            deduplicate,
+            storage=ArchiveStorage(archive_path, compression, compresslevel),
+        )
+        self.archive_path = archive_path
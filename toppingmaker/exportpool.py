@@ -0,0 +1,110 @@
+"""
+/***************************************************************************
+                              -------------------
+        begin                : 2022-07-17
+        git sha              : :%H$
+        copyright            : (C) 2022 by Dave Signer
+        email                : david at opengis ch
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union
+
+from .temporarystorage import TemporaryStorage
+from .toppingfile import ToppingFile
+
+
+class ExportPool:
+    """
+    Writes the serialized toppingfiles (styles, definitions and layout templates) to their files.
+
+    QGIS requires the serialization of styles, definitions and layouts to happen on the main thread. So the tree walk produces the content and only submits the writing as an export job.
+    With `max_workers` of 0 or 1 every job is written immediately (serial). Otherwise the jobs are written by a bounded pool of worker threads.
+    Jobs on the same path are written in the order they have been submitted, so the result is identical to the serial export.
+
+    With `direct_streaming` the content is not written to temporary files but kept in ToppingFile objects (in memory or spooled to disk when bigger than `max_memory_size`) until it's stored in the target.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 0,
+        direct_streaming: bool = False,
+        max_memory_size: int = ToppingFile.MAX_MEMORY_SIZE,
+    ):
+        self.max_workers = max_workers
+        self.direct_streaming = direct_streaming
+        self.max_memory_size = max_memory_size
+        self._executor = None
+        # limits the jobs (and their content) kept in memory while waiting for a worker
+        self._slots = None
+        # the last job submitted per path
+        self._pending = {}
+        # the toppingfiles already exported per content (e.g. the style of a layer added in several nodes), so they are serialized once
+        self.exported = {}
+        self._lock = threading.Lock()
+        if max_workers and max_workers > 1:
+            self._executor = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="toppingmaker_export"
+            )
+            self._slots = threading.BoundedSemaphore(max_workers * 4)
+
+    def toppingfile(
+        self, temporary_storage: TemporaryStorage, filename: str
+    ) -> Union[str, ToppingFile]:
+        """
+        Returns the destination of a toppingfile: The path of the temporary file in the storage or with direct_streaming a ToppingFile.
+        """
+        if self.direct_streaming:
+            return ToppingFile(filename, self.max_memory_size)
+        return temporary_storage.path(filename)
+
+    def submit(self, path: Union[str, ToppingFile], content: bytes):
+        """
+        Writes the content to the path (or ToppingFile) - immediately or by a worker.
+        """
+        if not self._executor:
+            self._write(path, content)
+            return
+
+        self._slots.acquire()
+        with self._lock:
+            previous_job = self._pending.get(path)
+            job = self._executor.submit(self._write, path, content, previous_job)
+            self._pending[path] = job
+        job.add_done_callback(lambda _: self._slots.release())
+
+    def wait(self):
+        """
+        Waits until all submitted jobs are written and releases the workers.
+        """
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+            self._pending = {}
+
+    def _write(self, path: Union[str, ToppingFile], content: bytes, previous_job=None):
+        if previous_job:
+            # the jobs are taken in submission order, so the previous one is already running or done
+            previous_job.result()
+        try:
+            if isinstance(path, ToppingFile):
+                path.write(content)
+                return True
+            # the directory is created once by the temporary storage
+            with open(path, "wb") as toppingfile:
+                toppingfile.write(content)
+        except OSError as exception:
+            logging.warning(f"Could not write toppingfile {path}: {exception}")
+            return False
+        return True
@@ -16,10 +16,23 @@
  *                                                                         *
  ***************************************************************************/
 """
+import fnmatch
+import logging
+import re
 from enum import Enum
 from typing import Union
 
-from qgis.core import QgsLayerTreeGroup, QgsLayerTreeLayer
+from qgis.core import (
+    QgsLayerTreeGroup,
+    QgsLayerTreeLayer,
+    QgsLayerTreeNode,
+    QgsProject,
+    QgsVectorLayer,
+)
+from qgis.PyQt import sip
+
+from .layerindex import LayerIndex
+from .utils import group_path
 
 
 class ExportSettings:
@@ -60,6 +73,22 @@ class ExportSettings:
         ("Node2","robot"): { export: True, categories: <QgsMapLayer.StyleCategories> }
     }
 
+    # Rules:
+
+    Instead of listing every node, the settings can be defined by rules in `rules` (added with `add_rule`). A rule defines the setting of all the nodes matching its conditions:
+    - name: glob pattern (or compiled regular expression) of the node name
+    - provider: glob pattern (or compiled regular expression) of the data provider name of the layer (e.g. "postgres")
+    - group_path: glob pattern (or compiled regular expression) of the path of the parent groups joined by "/" (e.g. "Big Group/*")
+    - geometry_type: the geometry type of the (vector) layer
+    - style_name: glob pattern (or compiled regular expression) of the style name (per default "default")
+
+    The rules are only considered for nodes without a setting in the dicts above. The first matching rule (in the order of `rules`) wins.
+
+    # Compiled settings:
+
+    Before walking through the layertree, the settings can be compiled with `compile(project)`. This resolves the settings of all the nodes (node keys before name keys) into a flat table per node.
+    The lookups during the walk are then a single access. Keys matching no node of the project (e.g. typos in the names) are reported with a warning and listed in `unmatched_keys`.
+
     # Mapthemes:
 
     The map themes to export are a simple list of map theme names stored in `mapthemes`.
@@ -67,6 +96,7 @@ class ExportSettings:
     # Custom Project Variables:
 
     The custom variables to export are a simple list of the keys stored in `variables`.
+    Additionally all the custom variables with a key matching one of the glob patterns (e.g. "ili2db_*") in `variable_patterns` are exported.
 
     # Layouts:
 
@@ -79,6 +109,221 @@ class ExportSettings:
         DEFINITION = 2
         SOURCE = 3
 
+    class Rule:
+        """
+        A rule defining the setting of all the nodes matching its conditions. Conditions that are None match every node.
+        The glob patterns are compiled once when the rule is created.
+        """
+
+        def __init__(
+            self,
+            type: "ExportSettings.ToppingType",
+            export=True,
+            categories=None,
+            name=None,
+            provider=None,
+            group_path=None,
+            geometry_type=None,
+            style_name="default",
+        ):
+            self.type = type
+            # the setting of the matching nodes
+            self.setting = {"export": export}
+            if categories:
+                self.setting["categories"] = categories
+            self.name = self._pattern(name)
+            self.provider = self._pattern(provider)
+            self.group_path = self._pattern(group_path)
+            self.geometry_type = geometry_type
+            self.style_name = self._pattern(style_name)
+
+        def __repr__(self):
+            return f"Rule({self.type.name}, {self.setting})"
+
+        def matches(
+            self,
+            name: str,
+            group_path: str = None,
+            layer=None,
+            style_name: str = None,
+        ) -> bool:
+            """
+            Returns if the node with the name, path of the parent groups and layer (None for groups) matches the rule.
+            """
+            if self.style_name and not self.style_name.match(style_name or "default"):
+                return False
+            if self.name and not self.name.match(name or ""):
+                return False
+            if self.group_path and (
+                group_path is None or not self.group_path.match(group_path)
+            ):
+                return False
+            if self.provider and (
+                not layer
+                or not layer.dataProvider()
+                or not self.provider.match(layer.dataProvider().name())
+            ):
+                return False
+            if self.geometry_type is not None and (
+                not isinstance(layer, QgsVectorLayer)
+                or layer.geometryType() != self.geometry_type
+            ):
+                return False
+            return True
+
+        def _pattern(self, pattern):
+            # glob patterns are translated to regular expressions, compiled ones are taken as they are
+            if pattern is None or isinstance(pattern, re.Pattern):
+                return pattern
+            return re.compile(fnmatch.translate(pattern))
+
+    class CompiledSettings:
+        """
+        The layertree settings of ExportSettings resolved for all the nodes of a project.
+        It provides `get_setting` like ExportSettings and is created by `ExportSettings.compile`.
+        """
+
+        def __init__(
+            self,
+            export_settings: "ExportSettings",
+            project: QgsProject,
+            layer_index: LayerIndex = None,
+        ):
+            self.export_settings = export_settings
+            # the layers of the nodes matched by the rules (built when there are rules and none is passed)
+            self.layer_index = layer_index
+            # the settings per node (by the address of the node) with (type, style_name) as key
+            self.node_settings = {}
+            # the keys of the settings matching no node as (type, key)
+            self.unmatched_keys = []
+            # the rules matching no node
+            self.unmatched_rules = []
+            self._compile(project)
+
+        def get_setting(
+            self,
+            type: "ExportSettings.ToppingType",
+            node: Union[QgsLayerTreeLayer, QgsLayerTreeGroup] = None,
+            name: str = None,
+            style_name: str = None,
+        ) -> dict():
+            """
+            Returns an existing or an empty setting dict
+            """
+            settings = (
+                self.node_settings.get(sip.unwrapinstance(node)) if node else None
+            )
+            if settings is None:
+                # the node has not been compiled (e.g. it's not part of the project)
+                return self.export_settings.get_setting(type, node, name, style_name)
+            return settings.get((type, self._style_key(style_name)), {})
+
+        def _compile(self, project: QgsProject):
+            addresses_by_name = {}
+            # the nodes with the path of their parent groups
+            node_paths = []
+            root = project.layerTreeRoot()
+            nodes = [(root, None)] if root else []
+            while nodes:
+                node, group_path = nodes.pop()
+                address = sip.unwrapinstance(node)
+                self.node_settings[address] = {}
+                addresses_by_name.setdefault(node.name(), []).append(address)
+                node_paths.append((node, group_path))
+                # the path of the children (the root is not part of it)
+                if group_path is None:
+                    child_group_path = ""
+                elif group_path:
+                    child_group_path = f"{group_path}/{node.name()}"
+                else:
+                    child_group_path = node.name()
+                nodes.extend((child, child_group_path) for child in node.children())
+
+            for type in ExportSettings.ToppingType:
+                setting_nodes = self.export_settings._setting_nodes(type)
+                node_keys = []
+                # the name keys are resolved first, so the node keys take precedence
+                for key, setting in setting_nodes.items():
+                    if isinstance(key, QgsLayerTreeNode):
+                        node_keys.append(key)
+                        continue
+                    name, style_name = key if isinstance(key, tuple) else (key, None)
+                    addresses = addresses_by_name.get(name)
+                    if not addresses:
+                        self._unmatched_key(type, key)
+                        continue
+                    for address in addresses:
+                        self.node_settings[address][
+                            (type, self._style_key(style_name))
+                        ] = setting
+                for key in node_keys:
+                    address = sip.unwrapinstance(key)
+                    if address not in self.node_settings:
+                        self._unmatched_key(type, key)
+                        continue
+                    # an empty setting of a node falls back to the one of the name
+                    if setting_nodes[key]:
+                        self.node_settings[address][(type, None)] = setting_nodes[key]
+
+            if self.export_settings.rules:
+                self.layer_index = self.layer_index or LayerIndex(project)
+                matched_rules = set()
+                for node, group_path in node_paths:
+                    if group_path is not None:
+                        self._apply_rules(node, group_path, matched_rules)
+                for rule in self.export_settings.rules:
+                    if id(rule) not in matched_rules:
+                        logging.warning(
+                            "The rule {} matches no node of the project.".format(rule)
+                        )
+                        self.unmatched_rules.append(rule)
+
+        def _apply_rules(
+            self, node: QgsLayerTreeNode, group_path: str, matched_rules: set
+        ):
+            # the first matching rule is set for every type (and style) without a setting
+            settings = self.node_settings[sip.unwrapinstance(node)]
+            # the layer of a node not recognized as QgsLayerTreeLayer is looked up in the index as well
+            layer = (
+                None
+                if isinstance(node, QgsLayerTreeGroup)
+                else self.layer_index.layer_of_node(node)
+            )
+            style_names = [None]
+            if layer:
+                style_names.extend(
+                    style_name
+                    for style_name in layer.styleManager().styles()
+                    if style_name != "default"
+                )
+            for type in ExportSettings.ToppingType:
+                for style_name in (
+                    style_names
+                    if type == ExportSettings.ToppingType.QMLSTYLE
+                    else [None]
+                ):
+                    if settings.get((type, style_name)):
+                        continue
+                    rule = self.export_settings._matching_rule(
+                        type, node.name(), group_path, layer, style_name
+                    )
+                    if rule:
+                        matched_rules.add(id(rule))
+                        settings[(type, style_name)] = rule.setting
+
+        def _unmatched_key(self, type: "ExportSettings.ToppingType", key):
+            logging.warning(
+                "The {} setting {} matches no node of the project.".format(
+                    type.name.lower(), key
+                )
+            )
+            self.unmatched_keys.append((type, key))
+
+        def _style_key(self, style_name: str = None):
+            if style_name and style_name != "default":
+                return style_name
+            return None
+
     def __init__(self):
         # layertree settings per layer / group and type of export
         self.qmlstyle_setting_nodes = {}
@@ -88,8 +333,12 @@ class ExportSettings:
         self.mapthemes = []
         # keys of custom variables to be exported
         self.variables = []
+        # glob patterns of the keys of custom variables to be exported
+        self.variable_patterns = []
         # names of layouts
         self.layouts = []
+        # rules defining the layertree settings of the nodes without a setting in the dicts above
+        self.rules = []
 
     def set_setting_values(
         self,
@@ -121,7 +370,90 @@ class ExportSettings:
         Returns an existing or an empty setting dict
         """
         setting_nodes = self._setting_nodes(type)
-        return self._get_setting(setting_nodes, node, name, style_name)
+        setting = self._get_setting(setting_nodes, node, name, style_name)
+        # the rules are considered for nodes without setting (but not for the root)
+        if not setting and self.rules and not (node and not node.parent()):
+            layer = node.layer() if isinstance(node, QgsLayerTreeLayer) else None
+            rule = self._matching_rule(
+                type,
+                node.name() if node else name,
+                group_path(node),
+                layer,
+                style_name,
+            )
+            if rule:
+                return rule.setting
+        return setting
+
+    def add_rule(
+        self,
+        type: ToppingType,
+        export=True,
+        categories=None,
+        name=None,
+        provider=None,
+        group_path=None,
+        geometry_type=None,
+        style_name="default",
+    ) -> "ExportSettings.Rule":
+        """
+        Appends a rule defining the setting of all the nodes matching the conditions (see `Rule`).
+        """
+        rule = ExportSettings.Rule(
+            type,
+            export,
+            categories,
+            name,
+            provider,
+            group_path,
+            geometry_type,
+            style_name,
+        )
+        self.rules.append(rule)
+        return rule
+
+    def compile(
+        self, project: QgsProject, layer_index: LayerIndex = None
+    ) -> "ExportSettings.CompiledSettings":
+        """
+        Returns the settings resolved for all the nodes of the project. Keys matching no node are reported with a warning.
+        The layers of the nodes are looked up in the layer_index (built if none is passed).
+        """
+        return ExportSettings.CompiledSettings(self, project, layer_index)
+
+    def variable_keys(self, custom_variable_keys: list = None) -> list:
+        """
+        Returns the keys of the variables to be exported: The ones in `variables` followed by the custom_variable_keys matching one of the `variable_patterns`.
+        """
+        variable_keys = list(self.variables)
+        if self.variable_patterns:
+            pattern = re.compile(
+                "|".join(
+                    fnmatch.translate(variable_pattern)
+                    for variable_pattern in self.variable_patterns
+                )
+            )
+            listed_keys = set(variable_keys)
+            variable_keys.extend(
+                key
+                for key in custom_variable_keys or []
+                if key not in listed_keys and pattern.match(key)
+            )
+        return variable_keys
+
+    def _matching_rule(
+        self,
+        type: ToppingType,
+        name: str,
+        group_path: str = None,
+        layer=None,
+        style_name: str = None,
+    ) -> "ExportSettings.Rule":
+        # the first rule of the type matching the node
+        for rule in self.rules:
+            if rule.type == type and rule.matches(name, group_path, layer, style_name):
+                return rule
+        return None
 
     def _setting_nodes(self, type: ToppingType):
         if type == ExportSettings.ToppingType.QMLSTYLE:
@@ -0,0 +1,74 @@
+"""
+/***************************************************************************
+                              -------------------
+        begin                : 2022-07-17
+        git sha              : :%H$
+        copyright            : (C) 2022 by Dave Signer
+        email                : david at opengis ch
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import logging
+
+from qgis.core import QgsLayerTreeNode, QgsMapLayer, QgsProject
+from qgis.PyQt import sip
+
+
+class LayerIndex:
+    """
+    An index of the layers of a project by id, by name and by layertree node.
+    It's built once (e.g. per parse) and shared, so a layer is found without scanning all the layers of the project.
+    """
+
+    def __init__(self, project: QgsProject = None):
+        self.layers_by_id = {}
+        # all the layers with the same name (in the order of the project)
+        self.layers_by_name = {}
+        # the layers of the layertree nodes (by the address of the node)
+        self.layers_by_node = {}
+        if project:
+            self.make_index(project)
+
+    def make_index(self, project: QgsProject):
+        self.layers_by_id = {}
+        self.layers_by_name = {}
+        self.layers_by_node = {}
+        for layer_id, layer in project.mapLayers().items():
+            self.layers_by_id[layer_id] = layer
+            self.layers_by_name.setdefault(layer.name(), []).append(layer)
+        root = project.layerTreeRoot()
+        if root:
+            for tree_layer in root.findLayers():
+                self.layers_by_node[sip.unwrapinstance(tree_layer)] = tree_layer.layer()
+
+    def layer_of_node(self, node: QgsLayerTreeNode) -> QgsMapLayer:
+        """
+        Returns the layer of the layertree node. It's looked up by the node and if not found by the name of the node.
+        """
+        layer = self.layers_by_node.get(sip.unwrapinstance(node))
+        if layer:
+            return layer
+        return self.layer_by_name(node.name())
+
+    def layer_by_name(self, name: str) -> QgsMapLayer:
+        """
+        Returns the layer with the name. If there are multiple layers with this name, the first one is returned with a warning.
+        """
+        layers = self.layers_by_name.get(name)
+        if not layers:
+            return None
+        if len(layers) > 1:
+            logging.warning(
+                "There are {} layers named {}. Taking the first one ({}).".format(
+                    len(layers), name, layers[0].id()
+                )
+            )
+        return layers[0]
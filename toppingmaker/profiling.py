@@ -0,0 +1,117 @@
+"""
+/***************************************************************************
+                              -------------------
+        begin                : 2022-07-17
+        git sha              : :%H$
+        copyright            : (C) 2022 by Dave Signer
+        email                : david at opengis ch
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import time
+
+
+class ProfilingReport:
+    """
+    The timings of parsing a project and generating the files.
+
+    - phases: the seconds per phase (e.g. "parse.layertree" or "parse.layerstyle" summing up the style exports)
+    - nodes: the seconds per layertree node (groups including their children)
+    - bytes: the bytes of the exported toppingfiles per type (layerstyle, layerdefinition, layouttemplate, projecttopping)
+
+    If `emit` is passed (a function taking a text), every finished phase is emitted - except the ones measured per file (e.g. the style exports), that are only summed up.
+    """
+
+    def __init__(self, emit=None, slowest_count: int = 10):
+        self.phases = {}
+        self.nodes = []
+        self.bytes = {}
+        self.emit = emit
+        self.slowest_count = slowest_count
+
+    def phase(self, name: str, emit: bool = True):
+        """
+        Returns a context measuring the phase. With `emit` False the time is only added to the report (for phases measured per file).
+        """
+        return _Phase(self, name, emit)
+
+    def add_time(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add_node(self, name: str, seconds: float, group: bool = False):
+        self.nodes.append({"name": name, "seconds": seconds, "group": group})
+
+    def add_bytes(self, type: str, count: int):
+        self.bytes[type] = self.bytes.get(type, 0) + count
+
+    def slowest_layers(self, count: int = None) -> list:
+        """
+        Returns the slowest layer nodes (without groups).
+        """
+        layer_nodes = [node for node in self.nodes if not node["group"]]
+        layer_nodes.sort(key=lambda node: node["seconds"], reverse=True)
+        return layer_nodes[: count or self.slowest_count]
+
+    def as_dict(self) -> dict:
+        return {
+            "phases": dict(self.phases),
+            "bytes": dict(self.bytes),
+            "slowest_layers": self.slowest_layers(),
+        }
+
+    def summary(self) -> str:
+        lines = [f"{name}: {seconds:.3f} s" for name, seconds in self.phases.items()]
+        lines.extend(f"{type}: {count} bytes" for type, count in self.bytes.items())
+        lines.extend(
+            f"slow layer {node['name']}: {node['seconds']:.3f} s"
+            for node in self.slowest_layers()
+        )
+        return "\n".join(lines)
+
+
+class _Phase:
+    def __init__(self, report: ProfilingReport, name: str, emit: bool = True):
+        self.report = report
+        self.name = name
+        self.emit = emit
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        seconds = time.perf_counter() - self.start
+        self.report.add_time(self.name, seconds)
+        if self.emit and self.report.emit:
+            self.report.emit(f"{self.name}: {seconds:.3f} s")
+        return False
+
+
+class _NoPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NO_PHASE = _NoPhase()
+
+
+def profiling_phase(report: ProfilingReport, name: str, emit: bool = True):
+    """
+    Returns the context measuring the phase in the report or a context doing nothing when profiling is disabled (report is None).
+    With `emit` False the phase is not emitted when it's finished (for phases measured per file).
+    """
+    if report:
+        return report.phase(name, emit)
+    return NO_PHASE
@@ -17,29 +17,47 @@
  ***************************************************************************/
 """
 
+import io
+import json
 import logging
 import os
+import shutil
 import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Union
 
-import yaml
 from qgis.core import (
     Qgis,
     QgsDataSourceUri,
+    QgsExpressionContextScope,
     QgsExpressionContextUtils,
     QgsLayerDefinition,
     QgsLayerTreeGroup,
     QgsLayerTreeLayer,
     QgsLayerTreeNode,
     QgsMapLayer,
+    QgsMapLayerStyle,
+    QgsMapThemeCollection,
+    QgsPathResolver,
+    QgsPrintLayout,
     QgsProject,
+    QgsRasterLayer,
     QgsReadWriteContext,
+    QgsVectorLayer,
 )
 from qgis.PyQt.QtCore import QObject, pyqtSignal
+from qgis.PyQt.QtXml import QDomDocument
 
+from .exportpool import ExportPool
 from .exportsettings import ExportSettings
+from .layerindex import LayerIndex
+from .profiling import ProfilingReport, profiling_phase
+from .serializer import YamlSerializer
 from .target import Target
-from .utils import slugify
+from .temporarystorage import TemporaryStorage
+from .toppingfile import ToppingFile
+from .utils import group_path, slugify
 
 
 class ProjectTopping(QObject):
@@ -62,17 +80,40 @@ class ProjectTopping(QObject):
     LAYERSTYLE_TYPE = "layerstyle"
     LAYOUTTEMPLATE_TYPE = "layouttemplate"
 
+    # providers of layers created as QgsRasterLayer on generate_project (the others are created as QgsVectorLayer)
+    RASTER_PROVIDERS = ["gdal", "wms", "wcs", "arcgismapserver", "postgresraster"]
+
     class TreeItemProperties:
         """
         The properties of a node (tree item)
+
+        The properties are kept in slots (without a dict per node) and the dict of the `styles` is only created when a style is added or the `styles` are accessed.
         """
 
+        __slots__ = (
+            "group",
+            "checked",
+            "expanded",
+            "featurecount",
+            "mutually_exclusive",
+            "mutually_exclusive_child",
+            "provider",
+            "uri",
+            "qmlstylefile",
+            "definitionfile",
+            "tablename",
+            "geometrycolumn",
+            "_styles",
+        )
+
         class StyleItemProperties:
             """
             The properties of a style item of a node style.
             Currently it's only a qmlstylefile. Maybe in future here a style can be defined.
             """
 
+            __slots__ = ("qmlstylefile",)
+
             def __init__(self):
                 # the style file - if None then not requested
                 self.qmlstylefile = None
@@ -102,28 +143,134 @@ class ProjectTopping(QObject):
             self.tablename = None
             # the geometry column (if no source available)
             self.geometrycolumn = None
-            # the styles can contain multiple style items with StyleItemProperties
-            self.styles = {}
+            # the styles can contain multiple style items with StyleItemProperties (created with the first style)
+            self._styles = None
+
+        @property
+        def styles(self) -> dict:
+            if self._styles is None:
+                self._styles = {}
+            return self._styles
+
+        @styles.setter
+        def styles(self, styles: dict):
+            self._styles = styles
+
+        @property
+        def has_styles(self) -> bool:
+            # without creating the styles
+            return bool(self._styles)
+
+        def add_style(
+            self,
+            style_name: str,
+            style_properties: "ProjectTopping.TreeItemProperties.StyleItemProperties",
+        ):
+            if self._styles is None:
+                self._styles = {}
+            self._styles[style_name] = style_properties
+
+    # the index of the layers of a project (see layerindex.LayerIndex)
+    LayerIndex = LayerIndex
 
     class LayerTreeItem:
         """
         A tree item of the layer tree. Every item contains the properties of a layer and according the ExportSettings passed on parsing the QGIS project.
+
+        The item is kept in slots and the list of the child `items` is only created when a child is added or the `items` are accessed.
         """
 
-        def __init__(self, temporary_toppingfile_dir=None):
-            self.items = []
+        __slots__ = ("_items", "name", "properties", "temporary_storage")
+
+        def __init__(self, temporary_storage: TemporaryStorage = None):
+            self._items = None
             self.name = None
             self.properties = ProjectTopping.TreeItemProperties()
-            self.temporary_toppingfile_dir = temporary_toppingfile_dir
-            if not self.temporary_toppingfile_dir:
-                self.temporary_toppingfile_dir = tempfile.mkdtemp()
+            # the storage of the temporary toppingfiles is shared with all the child items
+            self.temporary_storage = temporary_storage or TemporaryStorage()
+
+        @property
+        def items(self) -> list:
+            if self._items is None:
+                self._items = []
+            return self._items
+
+        @items.setter
+        def items(self, items: list):
+            self._items = items
+
+        def add_item(self, item: "ProjectTopping.LayerTreeItem"):
+            if self._items is None:
+                self._items = []
+            self._items.append(item)
+
+        @property
+        def temporary_toppingfile_dir(self) -> str:
+            return self.temporary_storage.directory
 
         def make_item(
             self,
             project: QgsProject,
             node: Union[QgsLayerTreeLayer, QgsLayerTreeGroup],
-            export_settings: ExportSettings,
+            export_settings: Union[ExportSettings, ExportSettings.CompiledSettings],
+            export_pool: ExportPool = None,
+            layer_index: "ProjectTopping.LayerIndex" = None,
+            profiling_report: ProfilingReport = None,
         ):
+            # the export pool writes the toppingfiles (serial if none is passed)
+            export_pool = export_pool or ExportPool()
+            # the layer index is built once and shared with all the child items
+            layer_index = layer_index or ProjectTopping.LayerIndex(project)
+            # the node is only timed when profiling
+            start = time.perf_counter() if profiling_report else None
+
+            if self._make_properties(
+                project,
+                node,
+                export_settings,
+                export_pool,
+                layer_index,
+                profiling_report,
+            ):
+                index = 0
+                for child in node.children():
+                    item = ProjectTopping.LayerTreeItem(self.temporary_storage)
+                    item.make_item(
+                        project,
+                        child,
+                        export_settings,
+                        export_pool,
+                        layer_index,
+                        profiling_report,
+                    )
+                    # set the first checked item as mutually exclusive child
+                    if (
+                        self.properties.mutually_exclusive
+                        and self.properties.mutually_exclusive_child == -1
+                    ):
+                        if item.properties.checked:
+                            self.properties.mutually_exclusive_child = index
+                    self.add_item(item)
+                    index += 1
+
+            if profiling_report:
+                profiling_report.add_node(
+                    self.name, time.perf_counter() - start, self.properties.group
+                )
+
+        def _make_properties(
+            self,
+            project: QgsProject,
+            node: Union[QgsLayerTreeLayer, QgsLayerTreeGroup],
+            export_settings: Union[ExportSettings, ExportSettings.CompiledSettings],
+            export_pool: ExportPool,
+            layer_index: "ProjectTopping.LayerIndex",
+            profiling_report: ProfilingReport = None,
+        ) -> bool:
+            """
+            Makes the name and the properties of the node (without its children).
+            Returns True if the children of the node need to be considered (a group not exported as DEFINITION).
+            """
             # properties for every kind of nodes
             self.name = node.name()
             self.properties.checked = node.itemVisibilityChecked()
@@ -133,36 +280,23 @@ class ProjectTopping(QObject):
                 ExportSettings.ToppingType.DEFINITION, node, node.name()
             )
             if definition_setting.get("export", False):
-                self.properties.definitionfile = self._temporary_definitionfile(node)
+                self.properties.definitionfile = self._temporary_definitionfile(
+                    node, export_pool, profiling_report
+                )
 
             if isinstance(node, QgsLayerTreeGroup):
                 # it's a group
                 self.properties.group = True
                 self.properties.mutually_exclusive = node.isMutuallyExclusive()
 
-                if not definition_setting.get("export", False):
-                    # only consider children, when the group is not exported as DEFINITION
-                    index = 0
-                    for child in node.children():
-                        item = ProjectTopping.LayerTreeItem(
-                            self.temporary_toppingfile_dir
-                        )
-                        item.make_item(project, child, export_settings)
-                        # set the first checked item as mutually exclusive child
-                        if (
-                            self.properties.mutually_exclusive
-                            and self.properties.mutually_exclusive_child == -1
-                        ):
-                            if item.properties.checked:
-                                self.properties.mutually_exclusive_child = index
-                        self.items.append(item)
-                        index += 1
+                # only consider children, when the group is not exported as DEFINITION
+                return not definition_setting.get("export", False)
             else:
                 if isinstance(node, QgsLayerTreeLayer):
                     layer = node.layer()
                 else:
                     # must be not recognized as QgsLayerTreeLayer (but QgsLayerTreeNode instead)
-                    layer = self._layer_of_node(project, node)
+                    layer = self._layer_of_node(layer_index, node)
                 self.properties.featurecount = node.customProperty("showFeatureCount")
                 source_setting = export_settings.get_setting(
                     ExportSettings.ToppingType.SOURCE, node, node.name()
@@ -208,16 +342,18 @@ class ProjectTopping(QObject):
                 if qml_default_setting.get("export", False):
                     self.properties.qmlstylefile = self._temporary_qmlstylefile(
                         layer,
+                        export_pool,
                         QgsMapLayer.StyleCategory(
                             qml_default_setting.get(
                                 "categories",
                                 QgsMapLayer.StyleCategory.AllStyleCategories,
                             )
                         ),
+                        profiling_report=profiling_report,
+                        node=node,
                     )
 
-                # get all the other styles
-                current_style = layer.styleManager().currentStyle()
+                # get all the other styles (read from the style manager without making them current if exported with all categories)
                 for style_name in layer.styleManager().styles():
                     # we skip the 'default' style because it's handled above
                     if style_name == "default":
@@ -235,6 +371,7 @@ class ProjectTopping(QObject):
                         )
                         style_properties.qmlstylefile = self._temporary_qmlstylefile(
                             layer,
+                            export_pool,
                             QgsMapLayer.StyleCategory(
                                 qml_style_setting.get(
                                     "categories",
@@ -242,56 +379,109 @@ class ProjectTopping(QObject):
                                 )
                             ),
                             style_name,
+                            profiling_report,
+                            node,
                         )
-                        self.properties.styles[style_name] = style_properties
-                # reset the style of the project layer
-                layer.styleManager().setCurrentStyle(current_style)
+                        self.properties.add_style(style_name, style_properties)
+            return False
 
         def _layer_of_node(
             self,
-            project: QgsProject,
+            layer_index: "ProjectTopping.LayerIndex",
             node: QgsLayerTreeNode,
-        ) -> QgsLayerTreeLayer:
+        ) -> QgsMapLayer:
             # workaround when layer has not been detected as QgsLayerTreeLayer.
             # See https://github.com/opengisch/QgisModelBaker/pull/514
-            return project.mapLayersByName(node.name())[0]
+            return layer_index.layer_of_node(node)
 
         def _temporary_definitionfile(
-            self, node: Union[QgsLayerTreeLayer, QgsLayerTreeGroup]
+            self,
+            node: Union[QgsLayerTreeLayer, QgsLayerTreeGroup],
+            export_pool: ExportPool,
+            profiling_report: ProfilingReport = None,
         ):
-            filename_slug = f"{slugify(self.name)}.qlr"
-            os.makedirs(self.temporary_toppingfile_dir, exist_ok=True)
-            temporary_toppingfile_path = os.path.join(
-                self.temporary_toppingfile_dir, filename_slug
+            filename_slug = self._unique_filename(
+                (ProjectTopping.LAYERDEFINITION_TYPE, self._node_identity(node)),
+                slugify(self.name),
+                node,
+                "qlr",
+            )
+            temporary_toppingfile_path = export_pool.toppingfile(
+                self.temporary_storage, filename_slug
+            )
+            # the paths in the definition are written like QgsLayerDefinition does when exporting to a file
+            context = QgsReadWriteContext()
+            absolute_paths, _ = QgsProject.instance().readBoolEntry(
+                "Paths", "/Absolute", False
             )
-            result, result_message = QgsLayerDefinition.exportLayerDefinition(
-                temporary_toppingfile_path, [node]
+            context.setPathResolver(
+                QgsPathResolver(
+                    ""
+                    if absolute_paths
+                    else os.path.join(self.temporary_toppingfile_dir, filename_slug)
+                )
             )
+            # measured per file, so it's summed up and not emitted
+            with profiling_phase(profiling_report, "parse.layerdefinition", emit=False):
+                document = QDomDocument("qgis-layer-definition")
+                result, result_message = QgsLayerDefinition.exportLayerDefinition(
+                    document, [node], context
+                )
+                content = bytes(document.toByteArray(2)) if result else None
             if not result:
                 logging.warning(
                     "Could not export definitionfile of {} to {}: {}".format(
                         node.name(), temporary_toppingfile_path, result_message
                     )
                 )
+            else:
+                if profiling_report:
+                    profiling_report.add_bytes(
+                        ProjectTopping.LAYERDEFINITION_TYPE, len(content)
+                    )
+                export_pool.submit(temporary_toppingfile_path, content)
             return temporary_toppingfile_path
 
         def _temporary_qmlstylefile(
             self,
             layer: QgsMapLayer,
+            export_pool: ExportPool,
             categories: QgsMapLayer.StyleCategories = QgsMapLayer.StyleCategory.AllStyleCategories,
             style_name: str = None,
+            profiling_report: ProfilingReport = None,
+            node: QgsLayerTreeNode = None,
         ):
-            filename_slug = f"{slugify(self.name)}{f'_{slugify(style_name)}' if style_name else ''}.qml"
-            os.makedirs(self.temporary_toppingfile_dir, exist_ok=True)
-            temporary_toppingfile_path = os.path.join(
-                self.temporary_toppingfile_dir, filename_slug
+            # the same style of a layer in another node is exported only once
+            export_key = (
+                ProjectTopping.LAYERSTYLE_TYPE,
+                layer.id(),
+                style_name or "default",
+                int(categories),
             )
-            if style_name:
-                layer.styleManager().setCurrentStyle(style_name)
-            result_message, result = layer.saveNamedStyle(
-                temporary_toppingfile_path, categories
+            if export_key in export_pool.exported:
+                return export_pool.exported[export_key]
+            filename_slug = self._unique_filename(
+                (ProjectTopping.LAYERSTYLE_TYPE, layer.id(), style_name or "default"),
+                ProjectTopping.LayerTreeItem._style_slug(self.name, style_name),
+                node,
+                "qml",
             )
-            if not result:
+            temporary_toppingfile_path = export_pool.toppingfile(
+                self.temporary_storage, filename_slug
+            )
+            # the style is serialized here (on the main thread) and written by the export pool
+            with profiling_phase(profiling_report, "parse.layerstyle", emit=False):
+                if style_name:
+                    document, result_message = self._named_style_document(
+                        layer, categories, style_name
+                    )
+                else:
+                    document = QDomDocument()
+                    result_message = layer.exportNamedStyle(
+                        document, QgsReadWriteContext(), categories
+                    )
+                content = None if result_message else bytes(document.toByteArray(2))
+            if result_message:
                 logging.warning(
                     "Could not export qmlstylefile of {} ({}) to {}: {}".format(
                         layer.name(),
@@ -300,10 +490,128 @@ class ProjectTopping(QObject):
                         result_message,
                     )
                 )
+            else:
+                if profiling_report:
+                    profiling_report.add_bytes(
+                        ProjectTopping.LAYERSTYLE_TYPE, len(content)
+                    )
+                export_pool.submit(temporary_toppingfile_path, content)
+            export_pool.exported[export_key] = temporary_toppingfile_path
             return temporary_toppingfile_path
 
+        def _unique_filename(
+            self, key: tuple, slug: str, node: QgsLayerTreeNode, extension: str
+        ) -> str:
+            # the same layer (or group) gets always the same filename. If there are others with the same name (reserved with reserve_filenames), it's prefixed with its group path.
+            return self.temporary_storage.slug_registry.unique_slug(
+                key,
+                slug,
+                lambda: slugify(group_path(node)),
+                f".{extension}",
+            )
+
+        @staticmethod
+        def reserve_filenames(
+            temporary_storage: TemporaryStorage,
+            root: QgsLayerTreeGroup,
+            layer_index: "ProjectTopping.LayerIndex",
+        ):
+            """
+            Reserves the filenames of the possible style and definition files of all the nodes under the root.
+            So the filename of a node depends only on the node and the other names in the project (and not on the order the files are exported in).
+            """
+            slug_registry = temporary_storage.slug_registry
+            # the nodes with their group path (like _node_identity)
+            stack = [(node, "") for node in root.children()]
+            while stack:
+                node, parent_path = stack.pop()
+                if isinstance(node, QgsLayerTreeGroup):
+                    node_identity = (
+                        f"{parent_path}/{node.name()}" if parent_path else node.name()
+                    )
+                    stack.extend((child, node_identity) for child in node.children())
+                elif isinstance(node, QgsLayerTreeLayer):
+                    node_identity = node.layerId()
+                else:
+                    node_identity = ProjectTopping.LayerTreeItem._node_identity(node)
+                slug_registry.reserve(
+                    (ProjectTopping.LAYERDEFINITION_TYPE, node_identity),
+                    slugify(node.name()),
+                    ".qlr",
+                )
+                if isinstance(node, QgsLayerTreeGroup):
+                    continue
+                layer = layer_index.layer_of_node(node)
+                if not layer:
+                    continue
+                for style_name in [None] + [
+                    style_name
+                    for style_name in layer.styleManager().styles()
+                    if style_name != "default"
+                ]:
+                    slug_registry.reserve(
+                        (
+                            ProjectTopping.LAYERSTYLE_TYPE,
+                            layer.id(),
+                            style_name or "default",
+                        ),
+                        ProjectTopping.LayerTreeItem._style_slug(
+                            node.name(), style_name
+                        ),
+                        ".qml",
+                    )
+
+        @staticmethod
+        def _style_slug(name: str, style_name: str = None) -> str:
+            return f"{slugify(name)}{f'_{slugify(style_name)}' if style_name else ''}"
+
+        @staticmethod
+        def _node_identity(node: QgsLayerTreeNode) -> str:
+            # the id of the layer or the path of the group
+            if isinstance(node, QgsLayerTreeLayer):
+                return node.layerId()
+            parent_path = group_path(node)
+            return f"{parent_path}/{node.name()}" if parent_path else node.name()
+
+        def _named_style_document(
+            self,
+            layer: QgsMapLayer,
+            categories: QgsMapLayer.StyleCategories,
+            style_name: str,
+        ):
+            # returns the document of the named style and an error message (empty on success)
+            style_manager = layer.styleManager()
+            if int(categories) == int(QgsMapLayer.StyleCategory.AllStyleCategories):
+                # the stored xml of the style is taken without making it current (no re-applying of the renderer)
+                style = style_manager.style(style_name)
+                document = QDomDocument()
+                if style.isValid() and document.setContent(style.xmlData())[0]:
+                    return document, ""
+
+            # with some categories (or if the style manager has no stored xml), the style is made current for the export
+            # since only QGIS knows which elements of the style belong to which categories
+            current_style = style_manager.currentStyle()
+            style_manager.setCurrentStyle(style_name)
+            document = QDomDocument()
+            result_message = layer.exportNamedStyle(
+                document, QgsReadWriteContext(), categories
+            )
+            style_manager.setCurrentStyle(current_style)
+            return document, result_message
+
         def item_dict(self, target: Target):
             item_dict = {}
+            item_properties_dict = self._item_properties_dict(target)
+
+            if self._items:
+                child_item_dict_list = self.items_list(target)
+                item_properties_dict["child-nodes"] = child_item_dict_list
+
+            item_dict[self.name] = item_properties_dict
+            return item_dict
+
+        def _item_properties_dict(self, target: Target) -> dict:
+            # the properties of the item (without its children) - the toppingfiles are stored in the target
             item_properties_dict = {}
 
             if self.properties.group:
@@ -322,20 +630,29 @@ class ProjectTopping(QObject):
                         ] = self.properties.geometrycolumn
                 if self.properties.featurecount:
                     item_properties_dict["featurecount"] = True
+                styles = self.properties.styles if self.properties.has_styles else {}
+                # the style files of the layer are stored in one pass
+                style_links = target.toppingfile_links(
+                    [
+                        (ProjectTopping.LAYERSTYLE_TYPE, qmlstylefile)
+                        for qmlstylefile in [self.properties.qmlstylefile]
+                        + [
+                            style_properties.qmlstylefile
+                            for style_properties in styles.values()
+                        ]
+                        if qmlstylefile
+                    ]
+                )
                 if self.properties.qmlstylefile:
-                    item_properties_dict["qmlstylefile"] = target.toppingfile_link(
-                        ProjectTopping.LAYERSTYLE_TYPE, self.properties.qmlstylefile
-                    )
-                if self.properties.styles:
+                    item_properties_dict["qmlstylefile"] = style_links.pop(0)
+                if styles:
                     item_properties_dict["styles"] = {}
-                    for style_name in self.properties.styles.keys():
+                    for style_name in styles.keys():
                         item_properties_dict["styles"][style_name] = {}
-                        item_properties_dict["styles"][style_name][
-                            "qmlstylefile"
-                        ] = target.toppingfile_link(
-                            ProjectTopping.LAYERSTYLE_TYPE,
-                            self.properties.styles[style_name].qmlstylefile,
-                        )
+                        if styles[style_name].qmlstylefile:
+                            item_properties_dict["styles"][style_name][
+                                "qmlstylefile"
+                            ] = style_links.pop(0)
                 if self.properties.provider and self.properties.uri:
                     item_properties_dict["provider"] = self.properties.provider
                     item_properties_dict["uri"] = self.properties.uri
@@ -348,69 +665,628 @@ class ProjectTopping(QObject):
                     ProjectTopping.LAYERDEFINITION_TYPE,
                     self.properties.definitionfile,
                 )
-
-            if self.items:
-                child_item_dict_list = self.items_list(target)
-                item_properties_dict["child-nodes"] = child_item_dict_list
-
-            item_dict[self.name] = item_properties_dict
-            return item_dict
+            return item_properties_dict
 
         def items_list(self, target: Target):
             item_list = []
-            for item in self.items:
+            for item in self._items or []:
                 item_dict = item.item_dict(target)
                 item_list.append(item_dict)
             return item_list
 
+        def walk_items(self, target: Target):
+            """
+            Yields the name, the properties dict and the number of children of the items in depth-first order (without recursion) and stores the toppingfiles in the target (in the same order as items_list).
+            """
+            stack = [iter(self._items or [])]
+            while stack:
+                item = next(stack[-1], None)
+                if item is None:
+                    stack.pop()
+                    continue
+                child_items = item._items or []
+                yield item.name, item._item_properties_dict(target), len(child_items)
+                if child_items:
+                    stack.append(iter(child_items))
+
+        def generate_nodes(
+            self, project: QgsProject, layers: dict, styled_items: list
+        ) -> list:
+            """
+            Creates the (detached) layertree nodes of the child items (see generate_node).
+            """
+            nodes = []
+            for item in self._items or []:
+                node = item.generate_node(project, layers, styled_items)
+                if node:
+                    nodes.append(node)
+            return nodes
+
+        def generate_node(
+            self, project: QgsProject, layers: dict, styled_items: list
+        ) -> QgsLayerTreeNode:
+            """
+            Creates the (detached) layertree node of the item and its children.
+            The created layers are collected in layers (per name, provider and uri) to add them to the project in one batch.
+            The items with styles are collected in styled_items as (layer, item) to apply the styles after all layers exist.
+            Returns None if the node cannot be created.
+            """
+            node = self._generate_node(project, layers, styled_items)
+            if not node or self.properties.definitionfile:
+                return node
+            if self.properties.group:
+                for child_node in self.generate_nodes(project, layers, styled_items):
+                    node.addChildNode(child_node)
+            self._finish_node(node)
+            return node
+
+        def _generate_node(
+            self, project: QgsProject, layers: dict, styled_items: list
+        ) -> QgsLayerTreeNode:
+            # creates the node of the item (without its children) - None if it cannot be created
+            if self.properties.definitionfile:
+                return self._definitionfile_node(project)
+
+            if self.properties.group:
+                return QgsLayerTreeGroup(self.name)
+
+            if not self.properties.provider or not self.properties.uri:
+                logging.warning(
+                    "Could not create layer {}: No source available.".format(self.name)
+                )
+                return None
+            # the same layer can be multiple times in the layertree
+            key = (self.name, self.properties.provider, self.properties.uri)
+            layer = layers.get(key)
+            if not layer:
+                layer = self._layer_of_source()
+                layers[key] = layer
+                if self.properties.qmlstylefile or self.properties.has_styles:
+                    styled_items.append((layer, self))
+            node = QgsLayerTreeLayer(layer)
+            if self.properties.featurecount:
+                node.setCustomProperty("showFeatureCount", True)
+            return node
+
+        def _finish_node(self, node: QgsLayerTreeNode):
+            # sets the states of the node (when its children are added)
+            if self.properties.group and self.properties.mutually_exclusive:
+                node.setIsMutuallyExclusive(
+                    True, self.properties.mutually_exclusive_child
+                )
+            node.setItemVisibilityChecked(self.properties.checked)
+            node.setExpanded(self.properties.expanded)
+
+        def generate_styles(self, layer: QgsMapLayer):
+            """
+            Applies the styles of the item to the layer. The named styles are added to the style manager and the default style stays the current one.
+            """
+            style_manager = layer.styleManager()
+            default_style = QgsMapLayerStyle()
+            default_style.readFromLayer(layer)
+            for style_name, style_properties in self.properties.styles.items():
+                if style_properties.qmlstylefile and self._import_qmlstylefile(
+                    layer, style_properties.qmlstylefile, style_name
+                ):
+                    style = QgsMapLayerStyle()
+                    style.readFromLayer(layer)
+                    style_manager.addStyle(style_name, style)
+            if self.properties.qmlstylefile:
+                self._import_qmlstylefile(layer, self.properties.qmlstylefile)
+            elif self.properties.has_styles:
+                default_style.writeToLayer(layer)
+
+        def _layer_of_source(self) -> QgsMapLayer:
+            uri = QgsProject.instance().pathResolver().readPath(self.properties.uri)
+            if self.properties.provider in ProjectTopping.RASTER_PROVIDERS:
+                layer = QgsRasterLayer(uri, self.name, self.properties.provider)
+            else:
+                layer = QgsVectorLayer(uri, self.name, self.properties.provider)
+            if not layer.isValid():
+                logging.warning(
+                    "Layer {} is not valid: {} ({})".format(
+                        self.name, uri, self.properties.provider
+                    )
+                )
+            return layer
+
+        def _definitionfile_node(self, project: QgsProject) -> QgsLayerTreeNode:
+            # the definition is loaded into a detached group and its node is taken from there
+            context = QgsReadWriteContext()
+            context.setPathResolver(
+                QgsPathResolver(
+                    ProjectTopping._toppingfile_path(self.properties.definitionfile)
+                    or ""
+                )
+            )
+            container_group = QgsLayerTreeGroup()
+            result, result_message = QgsLayerDefinition.loadLayerDefinition(
+                ProjectTopping._toppingfile_document(self.properties.definitionfile),
+                project,
+                container_group,
+                context,
+            )
+            if not result or not container_group.children():
+                logging.warning(
+                    "Could not load definitionfile of {} from {}: {}".format(
+                        self.name, self.properties.definitionfile, result_message
+                    )
+                )
+                return None
+            return container_group.children()[0].clone()
+
+        def _import_qmlstylefile(
+            self,
+            layer: QgsMapLayer,
+            qmlstylefile: Union[str, ToppingFile],
+            style_name: str = None,
+        ) -> bool:
+            result, result_message = layer.importNamedStyle(
+                ProjectTopping._toppingfile_document(qmlstylefile)
+            )
+            if not result:
+                logging.warning(
+                    "Could not import qmlstylefile of {} ({}) from {}: {}".format(
+                        layer.name(), style_name, qmlstylefile, result_message
+                    )
+                )
+            return result
+
+        def load_item_dict(self, item_dict: dict, target: Target):
+            """
+            Loads the item from a dict like the one written by item_dict.
+            The linked toppingfiles are not opened but kept as ToppingFile linking to the file in the target.
+            """
+            self.name, item_properties_dict = next(iter(item_dict.items()))
+            item_properties_dict = item_properties_dict or {}
+            self._load_properties(item_properties_dict, target)
+            self.load_items_list(item_properties_dict.get("child-nodes") or [], target)
+
+        def _load_properties(self, item_properties_dict: dict, target: Target):
+            # loads the properties of the item (without its children)
+            self.properties.group = item_properties_dict.get("group", False)
+            self.properties.mutually_exclusive = item_properties_dict.get(
+                "mutually-exclusive", False
+            )
+            self.properties.mutually_exclusive_child = item_properties_dict.get(
+                "mutually-exclusive-child", -1
+            )
+            self.properties.checked = item_properties_dict.get("checked", True)
+            self.properties.expanded = item_properties_dict.get("expanded", True)
+            self.properties.featurecount = item_properties_dict.get(
+                "featurecount", False
+            )
+            self.properties.tablename = item_properties_dict.get("tablename")
+            self.properties.geometrycolumn = item_properties_dict.get("geometrycolumn")
+            self.properties.provider = item_properties_dict.get("provider")
+            self.properties.uri = item_properties_dict.get("uri")
+
+            if item_properties_dict.get("qmlstylefile"):
+                self.properties.qmlstylefile = target.linked_toppingfile(
+                    item_properties_dict["qmlstylefile"]
+                )
+            for style_name, style_dict in (
+                item_properties_dict.get("styles") or {}
+            ).items():
+                style_properties = (
+                    ProjectTopping.TreeItemProperties.StyleItemProperties()
+                )
+                if style_dict and style_dict.get("qmlstylefile"):
+                    style_properties.qmlstylefile = target.linked_toppingfile(
+                        style_dict["qmlstylefile"]
+                    )
+                self.properties.add_style(style_name, style_properties)
+            if item_properties_dict.get("definitionfile"):
+                self.properties.definitionfile = target.linked_toppingfile(
+                    item_properties_dict["definitionfile"]
+                )
+
+        def load_items_list(self, items_list: list, target: Target):
+            self.items = None
+            for item_dict in items_list:
+                item = ProjectTopping.LayerTreeItem(self.temporary_storage)
+                item.load_item_dict(item_dict, target)
+                self.add_item(item)
+
+    class FlatLayerTree:
+        """
+        The layertree as flat arrays (a node table) instead of nested LayerTreeItems: Per node its `names`, `properties` and the index of its parent in `parents` (-1 for the top level nodes). The nodes are in depth-first order, so the children of a node follow it in their order.
+
+        It's parsed from the project, serialized to the projecttopping, loaded from it and generated to the layertree nodes of a project iteratively (without recursion), so there is no recursion limit for deep trees. It results in the same layertree in the projecttopping and the project as the LayerTreeItem.
+        The nested LayerTreeItems (sharing the properties) are available in `items`. They are built on the first access (with the recursion of the LayerTreeItem when they are used).
+        """
+
+        def __init__(self, temporary_storage: TemporaryStorage = None):
+            self.names = []
+            self.parents = []
+            self.properties = []
+            # the storage of the temporary toppingfiles
+            self.temporary_storage = temporary_storage or TemporaryStorage()
+            self._items = None
+
+        def __len__(self):
+            return len(self.names)
+
+        @property
+        def items(self) -> list:
+            """
+            The top level LayerTreeItems built from the node table (once).
+            """
+            if self._items is None:
+                self._items = []
+                tree_items = []
+                for name, parent, properties in zip(
+                    self.names, self.parents, self.properties
+                ):
+                    item = ProjectTopping.LayerTreeItem(self.temporary_storage)
+                    item.name = name
+                    item.properties = properties
+                    tree_items.append(item)
+                    if parent < 0:
+                        self._items.append(item)
+                    else:
+                        tree_items[parent].add_item(item)
+            return self._items
+
+        def make_item(
+            self,
+            project: QgsProject,
+            node: QgsLayerTreeGroup,
+            export_settings: Union[ExportSettings, ExportSettings.CompiledSettings],
+            export_pool: ExportPool = None,
+            layer_index: "ProjectTopping.LayerIndex" = None,
+            profiling_report: ProfilingReport = None,
+        ):
+            """
+            Makes the node table of the children of the node (usually the root). The properties are made like the ones of the LayerTreeItem.
+            """
+            export_pool = export_pool or ExportPool()
+            layer_index = layer_index or ProjectTopping.LayerIndex(project)
+            self._clear()
+            # makes the properties of one node after the other
+            node_item = ProjectTopping.LayerTreeItem(self.temporary_storage)
+            # the number of the children of every node (to find the mutually exclusive child)
+            child_counts = []
+
+            # when profiling, the started nodes (index and start) of the current path - a node is timed with its children like in the LayerTreeItem
+            open_nodes = []
+
+            stack = [(child, -1) for child in reversed(node.children())]
+            while stack:
+                child, parent = stack.pop()
+                index = len(self.names)
+                if profiling_report:
+                    self._finish_profiled_nodes(open_nodes, parent, profiling_report)
+                    open_nodes.append((index, time.perf_counter()))
+                node_item.properties = ProjectTopping.TreeItemProperties()
+                consider_children = node_item._make_properties(
+                    project,
+                    child,
+                    export_settings,
+                    export_pool,
+                    layer_index,
+                    profiling_report,
+                )
+                self.names.append(node_item.name)
+                self.parents.append(parent)
+                self.properties.append(node_item.properties)
+                child_counts.append(0)
+
+                if parent >= 0:
+                    # set the first checked child as mutually exclusive child
+                    parent_properties = self.properties[parent]
+                    if (
+                        parent_properties.mutually_exclusive
+                        and parent_properties.mutually_exclusive_child == -1
+                        and node_item.properties.checked
+                    ):
+                        parent_properties.mutually_exclusive_child = child_counts[
+                            parent
+                        ]
+                    child_counts[parent] += 1
+
+                if consider_children:
+                    stack.extend(
+                        (grandchild, index) for grandchild in reversed(child.children())
+                    )
+            if profiling_report:
+                self._finish_profiled_nodes(open_nodes, -1, profiling_report)
+
+        def _finish_profiled_nodes(
+            self, open_nodes: list, parent: int, profiling_report: ProfilingReport
+        ):
+            # the nodes not being the parent (or its ancestors) are complete with their children
+            while open_nodes and open_nodes[-1][0] != parent:
+                index, start = open_nodes.pop()
+                profiling_report.add_node(
+                    self.names[index],
+                    time.perf_counter() - start,
+                    self.properties[index].group,
+                )
+
+        def generate_nodes(
+            self, project: QgsProject, layers: dict, styled_items: list
+        ) -> list:
+            """
+            Creates the (detached) layertree nodes of the top level nodes and their children from the node table (without recursion) like LayerTreeItem.generate_nodes.
+            """
+            top_level_nodes = []
+            # per node the created group node to add the children to (None if its children are not created)
+            group_nodes = []
+            # the created nodes with their items, finished when their children are added
+            created_nodes = []
+            for name, parent, properties in zip(
+                self.names, self.parents, self.properties
+            ):
+                if parent >= 0 and group_nodes[parent] is None:
+                    group_nodes.append(None)
+                    continue
+                item = ProjectTopping.LayerTreeItem(self.temporary_storage)
+                item.name = name
+                item.properties = properties
+                node = item._generate_node(project, layers, styled_items)
+                if not node or properties.definitionfile:
+                    group_nodes.append(None)
+                else:
+                    group_nodes.append(node if properties.group else None)
+                    created_nodes.append((item, node))
+                if node:
+                    if parent < 0:
+                        top_level_nodes.append(node)
+                    else:
+                        group_nodes[parent].addChildNode(node)
+            # the children follow their parents, so in reversed order they are finished first (like in the LayerTreeItem)
+            for item, node in reversed(created_nodes):
+                item._finish_node(node)
+            return top_level_nodes
+
+        def items_list(self, target: Target) -> list:
+            """
+            Returns the layertree as a list of dicts (the same like the LayerTreeItem) and stores the toppingfiles in the target (in the same order).
+            """
+            items_list = []
+            # the properties dicts of the nodes (to append the child-nodes)
+            properties_dicts = []
+            node_item = ProjectTopping.LayerTreeItem(self.temporary_storage)
+            for name, parent, properties in zip(
+                self.names, self.parents, self.properties
+            ):
+                node_item.name = name
+                node_item.properties = properties
+                item_properties_dict = node_item._item_properties_dict(target)
+                properties_dicts.append(item_properties_dict)
+                if parent < 0:
+                    items_list.append({name: item_properties_dict})
+                else:
+                    properties_dicts[parent].setdefault("child-nodes", []).append(
+                        {name: item_properties_dict}
+                    )
+            return items_list
+
+        def walk_items(self, target: Target):
+            """
+            Yields the name, the properties dict and the number of children of the nodes in depth-first order and stores the toppingfiles in the target (in the same order as items_list).
+            """
+            child_counts = [0] * len(self.names)
+            for parent in self.parents:
+                if parent >= 0:
+                    child_counts[parent] += 1
+            node_item = ProjectTopping.LayerTreeItem(self.temporary_storage)
+            for name, properties, child_count in zip(
+                self.names, self.properties, child_counts
+            ):
+                node_item.name = name
+                node_item.properties = properties
+                yield name, node_item._item_properties_dict(target), child_count
+
+        def load_items_list(self, items_list: list, target: Target):
+            """
+            Loads the node table from a list of dicts like the one written by items_list.
+            """
+            self._clear()
+            node_item = ProjectTopping.LayerTreeItem(self.temporary_storage)
+            stack = [(item_dict, -1) for item_dict in reversed(items_list)]
+            while stack:
+                item_dict, parent = stack.pop()
+                index = len(self.names)
+                name, item_properties_dict = next(iter(item_dict.items()))
+                item_properties_dict = item_properties_dict or {}
+                node_item.properties = ProjectTopping.TreeItemProperties()
+                node_item._load_properties(item_properties_dict, target)
+                self.names.append(name)
+                self.parents.append(parent)
+                self.properties.append(node_item.properties)
+                stack.extend(
+                    (child_dict, index)
+                    for child_dict in reversed(
+                        item_properties_dict.get("child-nodes") or []
+                    )
+                )
+
+        def _clear(self):
+            self.names = []
+            self.parents = []
+            self.properties = []
+            self._items = None
+
     class MapThemes(dict):
         """
         A dict object of dict items describing a MapThemeRecord according to the maptheme names listed in the ExportSettings passed on parsing the QGIS project.
         """
 
+        # the values of a layer record not stored with compact (the defaults on generating the items)
+        COMPACT_DEFAULTS = {"visible": True, "expanded": False}
+
         def make_items(
             self,
             project: QgsProject,
             export_settings: ExportSettings,
+            compact: bool = False,
         ):
+            """
+            Makes the items of all the map themes in one pass.
+            With compact the values of the layer records being the default (visible and not expanded) are not stored.
+            """
             self.clear()
+            with_checked_groupnodes = Qgis.QGIS_VERSION_INT >= 33000
 
             maptheme_collection = project.mapThemeCollection()
             for name in export_settings.mapthemes:
                 maptheme_item = {}
                 maptheme_record = maptheme_collection.mapThemeState(name)
                 for layerrecord in maptheme_record.layerRecords():
-                    layername = layerrecord.layer().name()
-                    maptheme_item[layername] = {}
-                    if layerrecord.usingCurrentStyle:
-                        maptheme_item[layername]["style"] = layerrecord.currentStyle
-                    maptheme_item[layername]["visible"] = layerrecord.isVisible
-                    maptheme_item[layername]["expanded"] = layerrecord.expandedLayerNode
-                    if layerrecord.expandedLegendItems:
-                        maptheme_item[layername]["expanded_items"] = list(
-                            layerrecord.expandedLegendItems
-                        )
-                    if layerrecord.usingLegendItems:
-                        maptheme_item[layername]["checked_items"] = list(
-                            layerrecord.checkedLegendItems
-                        )
+                    layer = layerrecord.layer()
+                    if not layer:
+                        continue
+                    maptheme_item[layer.name()] = self._layerrecord_item(
+                        layerrecord, compact
+                    )
 
                 if maptheme_record.hasExpandedStateInfo():
                     for expanded_groupnode in maptheme_record.expandedGroupNodes():
-                        if expanded_groupnode not in maptheme_item:
-                            maptheme_item[expanded_groupnode] = {}
-                            maptheme_item[expanded_groupnode]["group"] = True
-                        maptheme_item[expanded_groupnode]["expanded"] = True
-                if Qgis.QGIS_VERSION_INT >= 33000:
-                    if maptheme_record.hasCheckedStateInfo():
-                        for checked_groupnode in maptheme_record.checkedGroupNodes():
-                            if checked_groupnode not in maptheme_item:
-                                maptheme_item[checked_groupnode] = {}
-                                maptheme_item[checked_groupnode]["group"] = True
-                            maptheme_item[checked_groupnode]["checked"] = True
+                        maptheme_item.setdefault(expanded_groupnode, {"group": True})[
+                            "expanded"
+                        ] = True
+                if with_checked_groupnodes and maptheme_record.hasCheckedStateInfo():
+                    for checked_groupnode in maptheme_record.checkedGroupNodes():
+                        maptheme_item.setdefault(checked_groupnode, {"group": True})[
+                            "checked"
+                        ] = True
 
                 self[name] = maptheme_item
 
+        @staticmethod
+        def _layerrecord_item(
+            layerrecord: QgsMapThemeCollection.MapThemeLayerRecord, compact: bool
+        ) -> dict:
+            layerrecord_item = {}
+            if layerrecord.usingCurrentStyle:
+                layerrecord_item["style"] = layerrecord.currentStyle
+            if not compact or not layerrecord.isVisible:
+                layerrecord_item["visible"] = layerrecord.isVisible
+            if not compact or layerrecord.expandedLayerNode:
+                layerrecord_item["expanded"] = layerrecord.expandedLayerNode
+            if layerrecord.expandedLegendItems:
+                layerrecord_item["expanded_items"] = list(
+                    layerrecord.expandedLegendItems
+                )
+            if layerrecord.usingLegendItems:
+                layerrecord_item["checked_items"] = list(layerrecord.checkedLegendItems)
+            return layerrecord_item
+
+        def delta_dict(self) -> dict:
+            """
+            Returns the map themes as one base and per theme only the delta to it:
+            {"base": {record_name: record}, "themes": {name: {"records": {record_name: record}, "removed": [record_name]}}}
+            The base contains per record name the record most of the themes have (if more than half of them have it). A theme contains only its records differing from the base and the names of the base records it does not have.
+            """
+            # the themes having the same record (by record name and serialized record)
+            record_counts = {}
+            for maptheme_item in self.values():
+                for record_name, record in maptheme_item.items():
+                    record_key = json.dumps(record, sort_keys=True)
+                    record_counts.setdefault(record_name, {}).setdefault(
+                        record_key, [record, 0]
+                    )[1] += 1
+
+            base = {}
+            for record_name, counts in record_counts.items():
+                record, count = max(counts.values(), key=lambda counted: counted[1])
+                if count * 2 > len(self):
+                    base[record_name] = record
+
+            themes = {}
+            for name, maptheme_item in self.items():
+                theme = {}
+                records = {
+                    record_name: record
+                    for record_name, record in maptheme_item.items()
+                    if base.get(record_name) != record
+                }
+                if records:
+                    theme["records"] = records
+                removed = [
+                    record_name
+                    for record_name in base.keys()
+                    if record_name not in maptheme_item
+                ]
+                if removed:
+                    theme["removed"] = removed
+                themes[name] = theme
+            return {"base": base, "themes": themes}
+
+        def load_delta_dict(self, delta_dict: dict):
+            """
+            Adds the map themes expanded from the base and their deltas (see `delta_dict`).
+            """
+            base = delta_dict.get("base") or {}
+            for name, theme in (delta_dict.get("themes") or {}).items():
+                theme = theme or {}
+                removed = set(theme.get("removed") or [])
+                maptheme_item = {
+                    record_name: dict(record)
+                    for record_name, record in base.items()
+                    if record_name not in removed
+                }
+                maptheme_item.update(theme.get("records") or {})
+                self[name] = maptheme_item
+
+        def generate_items(
+            self,
+            project: QgsProject,
+            layer_index: "ProjectTopping.LayerIndex" = None,
+        ):
+            """
+            Inserts the map themes into the project. The layers are found by name.
+            """
+            layer_index = layer_index or ProjectTopping.LayerIndex(project)
+
+            maptheme_collection = project.mapThemeCollection()
+            for name, maptheme_item in self.items():
+                maptheme_record = QgsMapThemeCollection.MapThemeRecord()
+                expanded_groupnodes = set()
+                checked_groupnodes = set()
+                for record_name, record in maptheme_item.items():
+                    if record.get("group", False):
+                        if record.get("expanded", False):
+                            expanded_groupnodes.add(record_name)
+                        if record.get("checked", False):
+                            checked_groupnodes.add(record_name)
+                        continue
+                    layer = layer_index.layer_by_name(record_name)
+                    if not layer:
+                        logging.warning(
+                            "Could not find layer {} of map theme {}".format(
+                                record_name, name
+                            )
+                        )
+                        continue
+                    layerrecord = QgsMapThemeCollection.MapThemeLayerRecord(layer)
+                    if "style" in record:
+                        layerrecord.usingCurrentStyle = True
+                        layerrecord.currentStyle = record["style"]
+                    layerrecord.isVisible = record.get(
+                        "visible", ProjectTopping.MapThemes.COMPACT_DEFAULTS["visible"]
+                    )
+                    layerrecord.expandedLayerNode = record.get(
+                        "expanded",
+                        ProjectTopping.MapThemes.COMPACT_DEFAULTS["expanded"],
+                    )
+                    if record.get("expanded_items"):
+                        layerrecord.expandedLegendItems = set(record["expanded_items"])
+                    if "checked_items" in record:
+                        layerrecord.usingLegendItems = True
+                        layerrecord.checkedLegendItems = set(record["checked_items"])
+                    maptheme_record.addLayerRecord(layerrecord)
+
+                if expanded_groupnodes:
+                    maptheme_record.setHasExpandedStateInfo(True)
+                    maptheme_record.setExpandedGroupNodes(expanded_groupnodes)
+                if Qgis.QGIS_VERSION_INT >= 33000 and checked_groupnodes:
+                    maptheme_record.setHasCheckedStateInfo(True)
+                    maptheme_record.setCheckedGroupNodes(checked_groupnodes)
+                maptheme_collection.insert(name, maptheme_record)
+
     class Variables(dict):
         """
         A dict object of dict items describing a variable according to the variable keys listed in the ExportSettings passed on parsing the QGIS project.
@@ -420,14 +1296,28 @@ class ProjectTopping(QObject):
             self,
             project: QgsProject,
             export_settings: ExportSettings,
+            project_scope: QgsExpressionContextScope = None,
         ):
             self.clear()
-            for variable_key in export_settings.variables:
-                variable_value = QgsExpressionContextUtils.projectScope(
-                    project
-                ).variable(variable_key)
+            # the project scope is built once (and not per variable)
+            project_scope = project_scope or QgsExpressionContextUtils.projectScope(
+                project
+            )
+            for variable_key in export_settings.variable_keys(
+                list(project.customVariables().keys())
+            ):
+                variable_value = project_scope.variable(variable_key)
                 self[variable_key] = variable_value or None
 
+        def generate_items(self, project: QgsProject):
+            """
+            Sets the variables as custom project variables (all at once).
+            """
+            QgsExpressionContextUtils.setProjectVariables(
+                project,
+                {key: value for key, value in self.items() if value is not None},
+            )
+
     class Properties(dict):
         """
         A dict object of dict items describing a selection of projet properties
@@ -441,37 +1331,58 @@ class ProjectTopping(QObject):
             else:
                 self["transaction_mode"] = project.transactionMode().name
 
+        def generate_items(self, project: QgsProject):
+            if "transaction_mode" in self:
+                if Qgis.QGIS_VERSION_INT < 32600:
+                    project.setAutoTransaction(bool(self["transaction_mode"]))
+                else:
+                    project.setTransactionMode(
+                        getattr(Qgis.TransactionMode, self["transaction_mode"])
+                    )
+
     class Layouts(dict):
         """
         A dict object of dict items describing a layout with templatefile according to the layout names listed in the ExportSettings passed on parsing the QGIS project.
         Such a dict item contains only one key at the moment: "templatefile"
         """
 
-        def __init__(self, temporary_toppingfile_dir=None):
-            self.temporary_toppingfile_dir = temporary_toppingfile_dir
-            if not self.temporary_toppingfile_dir:
-                self.temporary_toppingfile_dir = tempfile.mkdtemp()
+        def __init__(self, temporary_storage: TemporaryStorage = None):
+            self.temporary_storage = temporary_storage or TemporaryStorage()
+
+        @property
+        def temporary_toppingfile_dir(self) -> str:
+            return self.temporary_storage.directory
 
         def make_items(
             self,
             project: QgsProject,
             export_settings: ExportSettings,
+            export_pool: ExportPool = None,
+            profiling_report: ProfilingReport = None,
         ):
             self.clear()
+            # the export pool writes the toppingfiles (serial if none is passed)
+            export_pool = export_pool or ExportPool()
 
             # go through all the print layouts in the project and export the requested ones
             for layout in project.layoutManager().printLayouts():
                 if layout.name() in export_settings.layouts:
                     self[layout.name()] = {}
 
-                    filename_slug = f"{slugify(layout.name())}.qpt"
-                    os.makedirs(self.temporary_toppingfile_dir, exist_ok=True)
-                    temporary_toppingfile_path = os.path.join(
-                        self.temporary_toppingfile_dir, filename_slug
+                    # layouts with names resulting in the same slug get numbered filenames
+                    filename_slug = self.temporary_storage.slug_registry.unique_slug(
+                        (ProjectTopping.LAYOUTTEMPLATE_TYPE, layout.name()),
+                        slugify(layout.name()),
+                        suffix=".qpt",
                     )
+                    temporary_toppingfile_path = export_pool.toppingfile(
+                        self.temporary_storage, filename_slug
+                    )
+                    # the template is serialized like QgsLayout.saveAsTemplate does and written by the export pool
                     context = QgsReadWriteContext()
-                    result = layout.saveAsTemplate(temporary_toppingfile_path, context)
-                    if not result:
+                    document = QDomDocument()
+                    layout_element = layout.writeXml(document, context)
+                    if layout_element.isNull():
                         result_message = ", ".join(
                             [
                                 message.message()
@@ -486,69 +1397,185 @@ class ProjectTopping(QObject):
                                 result_message,
                             )
                         )
+                    else:
+                        document.appendChild(layout_element)
+                        content = bytes(document.toByteArray())
+                        if profiling_report:
+                            profiling_report.add_bytes(
+                                ProjectTopping.LAYOUTTEMPLATE_TYPE, len(content)
+                            )
+                        export_pool.submit(temporary_toppingfile_path, content)
                     self[layout.name()]["templatefile"] = temporary_toppingfile_path
 
         def item_dict(self, target: Target):
             resolved_items = {}
-            for layout_name in self.keys():
+            # the template files are stored in one pass
+            templatefile_links = target.toppingfile_links(
+                [
+                    (
+                        ProjectTopping.LAYOUTTEMPLATE_TYPE,
+                        self[layout_name]["templatefile"],
+                    )
+                    for layout_name in self.keys()
+                ]
+            )
+            for layout_name, templatefile_link in zip(self.keys(), templatefile_links):
                 resolved_item = {}
-                resolved_item["templatefile"] = target.toppingfile_link(
-                    ProjectTopping.LAYOUTTEMPLATE_TYPE,
-                    self[layout_name]["templatefile"],
-                )
+                resolved_item["templatefile"] = templatefile_link
                 resolved_items[layout_name] = resolved_item
             return resolved_items
 
+        def generate_items(self, project: QgsProject):
+            """
+            Creates the layouts from the template files and adds them to the project.
+            """
+            for layout_name, layout_item in self.items():
+                layout = QgsPrintLayout(project)
+                _, result = layout.loadFromTemplate(
+                    ProjectTopping._toppingfile_document(layout_item["templatefile"]),
+                    QgsReadWriteContext(),
+                )
+                if not result:
+                    logging.warning(
+                        "Could not load layout template of {} from {}".format(
+                            layout_name, layout_item["templatefile"]
+                        )
+                    )
+                    continue
+                layout.setName(layout_name)
+                project.layoutManager().addLayout(layout)
+
+        def load_item_dict(self, item_dict: dict, target: Target):
+            """
+            Loads the layouts from a dict like the one written by item_dict.
+            The template files are not opened but kept as ToppingFile linking to the file in the target.
+            """
+            self.clear()
+            for layout_name, layout_dict in item_dict.items():
+                if layout_dict and layout_dict.get("templatefile"):
+                    self[layout_name] = {
+                        "templatefile": target.linked_toppingfile(
+                            layout_dict["templatefile"]
+                        )
+                    }
+
     def __init__(self):
         QObject.__init__(self)
-        temporary_toppingfile_dir = tempfile.mkdtemp(
-            prefix="toppingmaker_temporary_files_"
-        )
+        # the temporary toppingfiles of the layertree and the layouts are stored in one directory (removed with cleanup)
+        self.temporary_storage = TemporaryStorage()
 
-        self.layertree = self.LayerTreeItem(temporary_toppingfile_dir)
+        self.layertree = self.LayerTreeItem(self.temporary_storage)
         self.mapthemes = self.MapThemes()
         self.layerorder = []
         self.variables = self.Variables()
         self.properties = self.Properties()
-        self.layouts = self.Layouts(temporary_toppingfile_dir)
+        self.layouts = self.Layouts(self.temporary_storage)
+        # the serializer writing the projecttopping file
+        self.serializer = YamlSerializer()
+        # when profiling, the timings and the written bytes of parse_project and generate_files are collected in the profiling_report
+        self.profiling = False
+        # if the timings of the phases are emitted through stdout while profiling
+        self.profiling_stream = False
+        self.profiling_report = None
+        # if the map themes are written as one base and the deltas of the themes (see MapThemes.delta_dict)
+        self.mapthemes_delta = False
+        # if the projecttopping file is written while traversing the layertree (instead of building the whole projecttopping dict first)
+        self.streaming = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cleanup()
+        return False
+
+    def cleanup(self):
+        """
+        Removes the temporary toppingfiles. Call it (or use the ProjectTopping as context manager) when the files are generated.
+        """
+        self.temporary_storage.cleanup()
 
     def parse_project(
-        self, project: QgsProject, export_settings: ExportSettings = ExportSettings()
+        self,
+        project: QgsProject,
+        export_settings: ExportSettings = ExportSettings(),
+        export_workers: int = 0,
+        direct_streaming: bool = False,
+        compact_mapthemes: bool = False,
+        flat_layertree: bool = False,
     ):
         """
         Parses a project into the ProjectTopping structure. Means the LayerTreeNodes are loaded into the layertree variable and append the ExportSettings to each node. The CustomLayerOrder is loaded into the layerorder. The project is not keeped as member variable.
 
         :param QgsProject project: the project to parse.
         :param ExportSettings settings: defining if the node needs a source or style / definitionfiles.
+        :param int export_workers: the number of threads writing the style, definition and layout template files. With 0 or 1 they are written serial.
+        :param bool direct_streaming: if the style, definition and layout template files are kept as ToppingFile (in memory or spooled) and written only once on generate_files instead of to temporary files.
+        :param bool compact_mapthemes: if the values of the map theme layer records being the default (visible and not expanded) are not stored.
+        :param bool flat_layertree: if the layertree is parsed (iteratively) into a FlatLayerTree instead of nested LayerTreeItems.
         """
         root = project.layerTreeRoot()
         if root:
+            # a new report is started per parse (None when not profiling)
+            self.profiling_report = self._new_profiling_report()
+            report = self.profiling_report
+            export_pool = ExportPool(export_workers, direct_streaming)
+            # the layers are indexed once per parse
+            layer_index = ProjectTopping.LayerIndex(project)
+            self._use_flat_layertree(flat_layertree)
+            # the layertree settings are resolved once for all the nodes
+            with profiling_phase(report, "parse.export_settings"):
+                compiled_settings = export_settings.compile(project, layer_index)
             # make layertree
-            self.layertree.make_item(project, project.layerTreeRoot(), export_settings)
+            with profiling_phase(report, "parse.layertree"):
+                ProjectTopping.LayerTreeItem.reserve_filenames(
+                    self.temporary_storage, root, layer_index
+                )
+                self.layertree.make_item(
+                    project,
+                    project.layerTreeRoot(),
+                    compiled_settings,
+                    export_pool,
+                    layer_index,
+                    report,
+                )
             self.stdout.emit(
                 self.tr("QGIS project layertree parsed with export settings."),
                 Qgis.Info,
             )
             # make layerorder
-            layerorder_layers = (
-                root.customLayerOrder() if root.hasCustomLayerOrder() else []
-            )
-            if layerorder_layers:
-                self.layerorder = [layer.name() for layer in layerorder_layers]
+            with profiling_phase(report, "parse.layerorder"):
+                layerorder_layers = (
+                    root.customLayerOrder() if root.hasCustomLayerOrder() else []
+                )
+                if layerorder_layers:
+                    self.layerorder = [layer.name() for layer in layerorder_layers]
             self.stdout.emit(self.tr("QGIS project layerorder parsed."), Qgis.Info)
             # make mapthemes
-            self.mapthemes.make_items(project, export_settings)
+            with profiling_phase(report, "parse.mapthemes"):
+                self.mapthemes.make_items(project, export_settings, compact_mapthemes)
             # make variables
-            self.variables.make_items(project, export_settings)
+            with profiling_phase(report, "parse.variables"):
+                self.variables.make_items(
+                    project,
+                    export_settings,
+                    QgsExpressionContextUtils.projectScope(project),
+                )
             # make print layouts
-            self.layouts.make_items(project, export_settings)
+            with profiling_phase(report, "parse.layouts"):
+                self.layouts.make_items(project, export_settings, export_pool, report)
             # make properties
-            self.properties.make_items(project)
+            with profiling_phase(report, "parse.properties"):
+                self.properties.make_items(project)
+            # wait until all the toppingfiles are written
+            with profiling_phase(report, "parse.export_pool_wait"):
+                export_pool.wait()
 
             self.stdout.emit(
                 self.tr("QGIS project map themes parsed with export settings."),
                 Qgis.Info,
             )
+            self._emit_profiling_summary()
         else:
             self.stdout.emit(
                 self.tr("Could not parse the QGIS project..."), Qgis.Warning
@@ -559,42 +1586,431 @@ class ProjectTopping(QObject):
     def generate_files(self, target: Target) -> str:
         """
         Generates all files according to the passed Target.
+        If the target is incremental, only the files differing from the ones in the target are written and the report is available in `target.manifest_report` until the next generation.
 
         :param Target target: the target object containing the paths where to create the files and the path_resolver defining the structure of the link.
         """
-        # generate projecttopping as a dict
-        projecttopping_dict = self._projecttopping_dict(target)
+        # the timings are added to the report of the parse (or a new one)
+        if self.profiling and not self.profiling_report:
+            self.profiling_report = self._new_profiling_report()
+        report = self.profiling_report if self.profiling else None
+
+        # the directory layout is created once (the directories are memoized by the target)
+        target.make_filedirs(
+            [
+                ProjectTopping.PROJECTTOPPING_TYPE,
+                ProjectTopping.LAYERSTYLE_TYPE,
+                ProjectTopping.LAYERDEFINITION_TYPE,
+                ProjectTopping.LAYOUTTEMPLATE_TYPE,
+            ]
+        )
+
+        # generate projecttopping as a dict (when streaming, it's generated while writing)
+        projecttopping_dict = None
+        if not self._streaming():
+            with profiling_phase(report, "generate.projecttopping_dict"):
+                projecttopping_dict = self._projecttopping_dict(target)
 
         # write the yaml
-        projecttopping_slug = f"{slugify(target.projectname)}.yaml"
+        projecttopping_slug = (
+            f"{slugify(target.projectname)}.{self.serializer.file_extension}"
+        )
         absolute_filedir_path, relative_filedir_path = target.filedir_path(
             ProjectTopping.PROJECTTOPPING_TYPE
         )
-        with open(
-            os.path.join(absolute_filedir_path, projecttopping_slug), "w"
-        ) as projecttopping_yamlfile:
-            yaml.dump(projecttopping_dict, projecttopping_yamlfile)
+        if target.incremental:
+            # the yaml is only written when it differs from the one in the target
+            with profiling_phase(report, "generate.serialization"):
+                projecttopping_yaml = io.StringIO()
+                self._dump_projecttopping(
+                    target, projecttopping_dict, projecttopping_yaml
+                )
+                content = projecttopping_yaml.getvalue().encode("utf-8")
+                target.store_file(
+                    os.path.join(absolute_filedir_path, projecttopping_slug),
+                    content=content,
+                )
+            if report:
+                report.add_bytes(ProjectTopping.PROJECTTOPPING_TYPE, len(content))
+            manifest_report = target.write_manifest()
+            self.stdout.emit(
+                self.tr(
+                    "Project Topping generated incremental: {} files written, {} skipped and {} removed."
+                ).format(
+                    len(manifest_report["written"]),
+                    len(manifest_report["skipped"]),
+                    len(manifest_report["removed"]),
+                ),
+                Qgis.Info,
+            )
+        else:
+            projecttopping_path = os.path.join(
+                absolute_filedir_path, projecttopping_slug
+            )
+            with profiling_phase(report, "generate.serialization"):
+                self._write_projecttopping(
+                    target, projecttopping_path, projecttopping_dict
+                )
+            if report:
+                report.add_bytes(
+                    ProjectTopping.PROJECTTOPPING_TYPE,
+                    target.file_size(projecttopping_path),
+                )
             self.stdout.emit(
                 self.tr("Project Topping written to YAML file: {}").format(
-                    projecttopping_yamlfile
+                    projecttopping_path
                 ),
                 Qgis.Info,
             )
+        # finish the target (e.g. the archive)
+        target.close()
+        self._emit_profiling_summary()
         return target.path_resolver(
             target, projecttopping_slug, ProjectTopping.PROJECTTOPPING_TYPE
         )
 
-    def load_files(self, target: Target):
+    @staticmethod
+    def generate_files_concurrently(toppings: list, workers: int = 4) -> list:
+        """
+        Generates the files of many ProjectToppings concurrently, e.g. into one repository (Targets with the same main_dir).
+        Returns the links of the projecttopping files (in the same order as the toppings).
+
+        :param list toppings: the ProjectToppings and their Target as (ProjectTopping, Target) tuples. Every ProjectTopping needs its own Target with its own projecttopping file (a Target or a projectname in the same directories passed twice raises a ValueError). A ProjectTopping is generated by one thread at a time, so it cannot be passed twice either (its toppingfiles are shared by the generations).
+        :param int workers: the number of threads generating the files. With 0 or 1 they are generated one after the other.
+        """
+        # two generations into the same projecttopping file (and manifest) would overwrite each other
+        projecttopping_files = set()
+        project_topping_ids = set()
+        for project_topping, target in toppings:
+            # the generations of one ProjectTopping would read its toppingfiles concurrently
+            if id(project_topping) in project_topping_ids:
+                raise ValueError(
+                    "The ProjectTopping generated to {} is passed twice.".format(
+                        target.projectname
+                    )
+                )
+            project_topping_ids.add(id(project_topping))
+            projecttopping_file = (
+                os.path.normpath(target.main_dir),
+                os.path.normpath(target.sub_dir or ""),
+                slugify(target.projectname),
+            )
+            if projecttopping_file in projecttopping_files:
+                raise ValueError(
+                    "The projecttopping file of {} in {} is generated twice.".format(
+                        target.projectname,
+                        os.path.join(target.main_dir, target.sub_dir or ""),
+                    )
+                )
+            projecttopping_files.add(projecttopping_file)
+        if not workers or workers <= 1:
+            return [
+                project_topping.generate_files(target)
+                for project_topping, target in toppings
+            ]
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="toppingmaker_generate"
+        ) as executor:
+            jobs = [
+                executor.submit(project_topping.generate_files, target)
+                for project_topping, target in toppings
+            ]
+            return [job.result() for job in jobs]
+
+    def load_files(self, target: Target, flat_layertree: bool = False):
+        """
+        Loads the projecttopping file of the passed Target into the ProjectTopping structure (layertree, mapthemes, variables, properties, layouts and layerorder).
+        The linked toppingfiles (styles, definitions and layout templates) are not opened but kept as ToppingFile, reading the file only when the content is accessed.
+
+        :param Target target: the target object containing the paths where the files have been generated.
+        :param bool flat_layertree: if the layertree is loaded (iteratively) into a FlatLayerTree instead of nested LayerTreeItems.
+        """
+        projecttopping_slug = (
+            f"{slugify(target.projectname)}.{self.serializer.file_extension}"
+        )
+        absolute_filedir_path, _ = target.filedir_path(
+            ProjectTopping.PROJECTTOPPING_TYPE
+        )
+        projecttopping_path = os.path.join(absolute_filedir_path, projecttopping_slug)
+        if not target.file_exists(projecttopping_path):
+            self.stdout.emit(
+                self.tr("Could not find the Project Topping file: {}").format(
+                    projecttopping_path
+                ),
+                Qgis.Warning,
+            )
+            return False
+
+        projecttopping_dict = (
+            self.serializer.load(target.read_file(projecttopping_path).decode("utf-8"))
+            or {}
+        )
+
+        self._use_flat_layertree(flat_layertree)
+        self.layertree.load_items_list(
+            projecttopping_dict.get("layertree") or [], target
+        )
+        self.mapthemes.clear()
+        self.mapthemes.update(projecttopping_dict.get("mapthemes") or {})
+        if projecttopping_dict.get("mapthemes-delta"):
+            self.mapthemes.load_delta_dict(projecttopping_dict["mapthemes-delta"])
+        self.variables.clear()
+        self.variables.update(projecttopping_dict.get("variables") or {})
+        self.properties.clear()
+        self.properties.update(projecttopping_dict.get("properties") or {})
+        self.layouts.load_item_dict(projecttopping_dict.get("layouts") or {}, target)
+        self.layerorder = projecttopping_dict.get("layerorder") or []
+
+        self.stdout.emit(
+            self.tr("Project Topping loaded from file: {}").format(projecttopping_path),
+            Qgis.Info,
+        )
+        return True
+
+    def generate_project(self, target: Target = None) -> QgsProject:
         """
-        - [ ] Not yet implemented.
+        Generates a QgsProject of the ProjectTopping: The layers (from provider and uri or from the definition files), groups, styles, map themes, layouts, variables, properties and the layerorder.
+        If the ProjectTopping has not been parsed or loaded, it's loaded from the passed target first.
+
+        All the layers are added to the project in one batch and the layertree is built detached and inserted at once, to avoid a signal per layer and node.
+        The styles are applied after all the layers exist.
+
+        :param Target target: the target object containing the paths where the files have been generated.
         """
-        raise NotImplementedError
+        if target and self._layertree_empty():
+            self.load_files(
+                target, isinstance(self.layertree, ProjectTopping.FlatLayerTree)
+            )
+
+        project = QgsProject()
+
+        # create the layers and the detached layertree nodes
+        layers = {}
+        styled_items = []
+        nodes = self.layertree.generate_nodes(project, layers, styled_items)
+        project.addMapLayers(list(layers.values()), False)
+        project.layerTreeRoot().insertChildNodes(0, nodes)
+        self.stdout.emit(
+            self.tr("QGIS project layertree generated with {} layers.").format(
+                len(layers)
+            ),
+            Qgis.Info,
+        )
+
+        # apply the styles when all the layers exist
+        for layer, item in styled_items:
+            item.generate_styles(layer)
+
+        layer_index = ProjectTopping.LayerIndex(project)
+
+        # set layerorder
+        if self.layerorder:
+            root = project.layerTreeRoot()
+            root.setCustomLayerOrder(
+                [
+                    layer_index.layer_by_name(layername)
+                    for layername in self.layerorder
+                    if layername in layer_index.layers_by_name
+                ]
+            )
+            root.setHasCustomLayerOrder(True)
+
+        self.mapthemes.generate_items(project, layer_index)
+        self.variables.generate_items(project)
+        self.layouts.generate_items(project)
+        self.properties.generate_items(project)
+
+        self.stdout.emit(
+            self.tr("QGIS project generated from Project Topping."), Qgis.Info
+        )
+        return project
+
+    def _use_flat_layertree(self, flat_layertree: bool):
+        # switches the layertree to a FlatLayerTree or to nested LayerTreeItems
+        if flat_layertree != isinstance(self.layertree, ProjectTopping.FlatLayerTree):
+            self.layertree = (
+                self.FlatLayerTree(self.temporary_storage)
+                if flat_layertree
+                else self.LayerTreeItem(self.temporary_storage)
+            )
+
+    def _layertree_empty(self) -> bool:
+        # without building the nested items of a FlatLayerTree
+        if isinstance(self.layertree, ProjectTopping.FlatLayerTree):
+            return not len(self.layertree)
+        return not self.layertree.items
+
+    def _new_profiling_report(self) -> ProfilingReport:
+        # None when not profiling - then the phases are not measured at all
+        if not self.profiling:
+            return None
+        emit = None
+        if self.profiling_stream:
+            emit = lambda text: self.stdout.emit(text, Qgis.Info)  # noqa: E731
+        return ProfilingReport(emit)
+
+    def _emit_profiling_summary(self):
+        if self.profiling and self.profiling_stream and self.profiling_report:
+            self.stdout.emit(
+                self.tr("Profiling report:\n{}").format(
+                    self.profiling_report.summary()
+                ),
+                Qgis.Info,
+            )
+
+    @staticmethod
+    def _toppingfile_path(toppingfile: Union[str, ToppingFile]) -> str:
+        # the path of the toppingfile - None if it's kept in memory
+        if isinstance(toppingfile, ToppingFile):
+            return toppingfile.path
+        return toppingfile
 
-    def generate_project(self, target: Target) -> QgsProject:
+    @staticmethod
+    def _toppingfile_document(toppingfile: Union[str, ToppingFile]) -> QDomDocument:
+        # the content of the toppingfile (temporary file or ToppingFile) as document
+        if isinstance(toppingfile, ToppingFile):
+            content = toppingfile.read()
+        else:
+            with open(toppingfile, "rb") as file:
+                content = file.read()
+        document = QDomDocument()
+        document.setContent(content)
+        return document
+
+    def _streaming(self) -> bool:
+        # a FlatLayerTree is always streamed, since dumping the nested projecttopping dict is recursive
+        return self.streaming or isinstance(
+            self.layertree, ProjectTopping.FlatLayerTree
+        )
+
+    def _write_projecttopping(
+        self, target: Target, projecttopping_path: str, projecttopping_dict: dict
+    ):
+        # the yaml is written through the target (e.g. to a file or an archive member)
+        if self._streaming() and target.storage.single_writer:
+            # the linked toppingfiles are stored while streaming, so the yaml is spooled and written to the storage afterwards
+            with tempfile.SpooledTemporaryFile(
+                ToppingFile.MAX_MEMORY_SIZE
+            ) as spooled_file:
+                self._dump_projecttopping_file(
+                    target, projecttopping_dict, spooled_file
+                )
+                spooled_file.seek(0)
+                with target.open_file(projecttopping_path) as projecttopping_file:
+                    shutil.copyfileobj(spooled_file, projecttopping_file)
+        else:
+            with target.open_file(projecttopping_path) as projecttopping_file:
+                self._dump_projecttopping_file(
+                    target, projecttopping_dict, projecttopping_file
+                )
+
+    def _dump_projecttopping_file(
+        self, target: Target, projecttopping_dict: dict, file
+    ):
+        # dumps to the binary file, that is closed (and on success committed) by the caller and not by the text wrapper
+        projecttopping_yamlfile = io.TextIOWrapper(file, encoding="utf-8")
+        try:
+            self._dump_projecttopping(
+                target, projecttopping_dict, projecttopping_yamlfile
+            )
+        finally:
+            # flushes the text to the file
+            projecttopping_yamlfile.detach()
+
+    def _dump_projecttopping(self, target: Target, projecttopping_dict: dict, stream):
+        # writes the projecttopping dict or (when streaming) the projecttopping while generating it
+        if self._streaming():
+            self._stream_projecttopping(target, stream)
+        else:
+            self.serializer.dump(projecttopping_dict, stream)
+
+    def _stream_projecttopping(self, target: Target, stream):
         """
-        - [ ] Not yet implemented.
+        Writes the projecttopping (the same as the one of _projecttopping_dict) to the stream while generating it.
+        The layertree is written node by node and the mapthemes theme by theme, so only the written node (and its parents) are in memory and not the whole projecttopping dict.
+        The sections are written in the sorted order of their keys (like the serializer does with the dict) and the toppingfiles are stored in the target in the same order.
         """
-        return QgsProject()
+        with self.serializer.stream_writer(stream) as writer:
+            writer.start_mapping()
+            if self.layerorder:
+                writer.write("layerorder")
+                writer.write(self.layerorder)
+            layertree_nodes = self.layertree.walk_items(target)
+            first_node = next(layertree_nodes, None)
+            if first_node:
+                writer.write("layertree")
+                writer.start_sequence()
+                self._stream_layertree(writer, first_node, layertree_nodes)
+                writer.end_sequence()
+            layouts_item_dict = self.layouts.item_dict(target)
+            if layouts_item_dict:
+                writer.write("layouts")
+                writer.write(layouts_item_dict)
+            if self.mapthemes and self.mapthemes_delta:
+                writer.write("mapthemes-delta")
+                writer.write(self.mapthemes.delta_dict())
+            elif self.mapthemes:
+                writer.write("mapthemes")
+                writer.start_mapping()
+                for maptheme_name in sorted(self.mapthemes.keys()):
+                    writer.write(maptheme_name)
+                    writer.write(self.mapthemes[maptheme_name])
+                writer.end_mapping()
+            properties_dict = dict(self.properties)
+            if properties_dict:
+                writer.write("properties")
+                writer.write(properties_dict)
+            variables_dict = dict(self.variables)
+            if variables_dict:
+                writer.write("variables")
+                writer.write(variables_dict)
+            writer.end_mapping()
+
+    @staticmethod
+    def _stream_layertree(writer, first_node: tuple, nodes):
+        # writes the nodes (name, properties dict and number of children in depth-first order) like items_list without recursion
+        # per node with children to write: the number of children left and the properties to write after the child-nodes
+        open_nodes = []
+        node = first_node
+        while node:
+            name, item_properties_dict, child_count = node
+            writer.start_mapping()
+            writer.write(name)
+            writer.start_mapping()
+            keys = sorted(item_properties_dict.keys())
+            if child_count:
+                # the child-nodes are written in the sorted order of the keys as well
+                following_keys = [key for key in keys if key > "child-nodes"]
+                for key in keys[: len(keys) - len(following_keys)]:
+                    writer.write(key)
+                    writer.write(item_properties_dict[key])
+                writer.write("child-nodes")
+                writer.start_sequence()
+                open_nodes.append(
+                    [
+                        child_count,
+                        {key: item_properties_dict[key] for key in following_keys},
+                    ]
+                )
+            else:
+                for key in keys:
+                    writer.write(key)
+                    writer.write(item_properties_dict[key])
+                writer.end_mapping()
+                writer.end_mapping()
+                # finish the parents whose last child has been written
+                while open_nodes:
+                    open_nodes[-1][0] -= 1
+                    if open_nodes[-1][0]:
+                        break
+                    _, following_properties_dict = open_nodes.pop()
+                    writer.end_sequence()
+                    for key, value in following_properties_dict.items():
+                        writer.write(key)
+                        writer.write(value)
+                    writer.end_mapping()
+                    writer.end_mapping()
+            node = next(nodes, None)
 
     def _projecttopping_dict(self, target: Target):
         """
@@ -610,9 +2026,12 @@ class ProjectTopping(QObject):
         layertree_items_list = self.layertree.items_list(target)
         if layertree_items_list:
             projecttopping_dict["layertree"] = layertree_items_list
-        mapthemes_dict = dict(self.mapthemes)
-        if mapthemes_dict:
-            projecttopping_dict["mapthemes"] = mapthemes_dict
+        if self.mapthemes and self.mapthemes_delta:
+            projecttopping_dict["mapthemes-delta"] = self.mapthemes.delta_dict()
+        else:
+            mapthemes_dict = dict(self.mapthemes)
+            if mapthemes_dict:
+                projecttopping_dict["mapthemes"] = mapthemes_dict
         variables_dict = dict(self.variables)
         if variables_dict:
             projecttopping_dict["variables"] = variables_dict
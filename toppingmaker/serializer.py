@@ -0,0 +1,155 @@
+"""
+/***************************************************************************
+                              -------------------
+        begin                : 2022-07-17
+        git sha              : :%H$
+        copyright            : (C) 2022 by Dave Signer
+        email                : david at opengis ch
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import yaml
+
+
+class Serializer:
+    """
+    The interface of the serializer writing the projecttopping dict to the projecttopping file.
+    Set another implementation to `ProjectTopping.serializer` to write another format.
+    """
+
+    # the extension of the projecttopping file
+    file_extension = None
+
+    def dump(self, data: dict, stream=None):
+        """
+        Writes the data to the (text) stream. Returns it as string if no stream is passed.
+        """
+        raise NotImplementedError
+
+    def load(self, stream) -> dict:
+        """
+        Reads the data from the (text) stream.
+        """
+        raise NotImplementedError
+
+    def stream_writer(self, stream):
+        """
+        Returns a writer to write the data piece by piece to the (text) stream (see `YamlStreamWriter`). Needed to generate the files with `ProjectTopping.streaming`.
+        """
+        raise NotImplementedError
+
+
+class YamlSerializer(Serializer):
+    """
+    Writes and reads the projecttopping dict as YAML.
+
+    Uses the libyaml-backed (C) dumper and safe loader if PyYAML is built with it. Otherwise (or with `use_libyaml=False`) the pure Python ones are used.
+    Both follow the same emitter rules and write the same output for the projecttopping structures.
+    """
+
+    file_extension = "yaml"
+
+    def __init__(self, use_libyaml: bool = True):
+        self.dumper = yaml.Dumper
+        self.loader = yaml.SafeLoader
+        if use_libyaml and yaml.__with_libyaml__:
+            self.dumper = yaml.CDumper
+            self.loader = yaml.CSafeLoader
+
+    def dump(self, data: dict, stream=None):
+        """
+        Writes the data to the (text) stream. Returns it as string if no stream is passed.
+        """
+        return yaml.dump(data, stream, Dumper=self.dumper)
+
+    def load(self, stream) -> dict:
+        """
+        Reads the data from the (text) stream or string.
+        """
+        return yaml.load(stream, Loader=self.loader)
+
+    def stream_writer(self, stream):
+        """
+        Returns a YamlStreamWriter to write the data piece by piece to the (text) stream.
+        """
+        return YamlStreamWriter(stream, self.dumper)
+
+
+class YamlStreamWriter:
+    """
+    Writes one YAML document piece by piece, as the events of the emitter: The mappings and sequences are started and ended explicitly and in between the keys and values (any data) are written with `write`.
+    So only the data being written is in memory and not the whole document.
+
+    When the keys of the mappings are written in sorted order, the output is the same as the one of `YamlSerializer.dump` with the whole data (except of aliases between the written pieces).
+    Use it as context manager (to start and end the document):
+
+        with serializer.stream_writer(stream) as writer:
+            writer.start_mapping()
+            writer.write("layerorder")
+            writer.write(["Layer A", "Layer B"])
+            writer.end_mapping()
+    """
+
+    def __init__(self, stream, dumper=yaml.Dumper):
+        # the same options as yaml.dump
+        self.dumper = dumper(stream, default_flow_style=False, sort_keys=True)
+        # the anchors of the serializer (not initialized by the libyaml-backed dumper)
+        self.dumper.anchors = {}
+        self.dumper.serialized_nodes = {}
+        self.dumper.last_anchor_id = 0
+
+    def __enter__(self):
+        self.dumper.open()
+        self.dumper.emit(yaml.DocumentStartEvent(explicit=False))
+        return self
+
+    def __exit__(self, exception_type, *args):
+        try:
+            if not exception_type:
+                self.dumper.emit(yaml.DocumentEndEvent(explicit=False))
+                self.dumper.close()
+        finally:
+            self.dumper.dispose()
+        return False
+
+    def start_mapping(self):
+        self.dumper.emit(
+            yaml.MappingStartEvent(
+                None, yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG, True, False
+            )
+        )
+
+    def end_mapping(self):
+        self.dumper.emit(yaml.MappingEndEvent())
+
+    def start_sequence(self):
+        self.dumper.emit(
+            yaml.SequenceStartEvent(
+                None, yaml.resolver.BaseResolver.DEFAULT_SEQUENCE_TAG, True, False
+            )
+        )
+
+    def end_sequence(self):
+        self.dumper.emit(yaml.SequenceEndEvent())
+
+    def write(self, data):
+        """
+        Writes the data (a key or a value) at once.
+        """
+        # represent and serialize it like yaml.dump does with the whole data
+        node = self.dumper.represent_data(data)
+        self.dumper.represented_objects = {}
+        self.dumper.object_keeper = []
+        self.dumper.alias_key = None
+        self.dumper.anchor_node(node)
+        self.dumper.serialize_node(node, None, None)
+        self.dumper.anchors = {}
+        self.dumper.serialized_nodes = {}
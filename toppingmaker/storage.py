@@ -0,0 +1,465 @@
+"""
+/***************************************************************************
+                              -------------------
+        begin                : 2022-07-17
+        git sha              : :%H$
+        copyright            : (C) 2022 by Dave Signer
+        email                : david at opengis ch
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import io
+import os
+import shutil
+import threading
+import time
+import zipfile
+from typing import Union
+
+from .toppingfile import ToppingFile
+from .utils import content_digest, file_digest
+
+
+class Storage:
+    """
+    Where a Target stores its files. The paths passed are the absolute paths of the target (main_dir joined with the relative path).
+
+    The base class defines the interface and writes the files through `open_file`. A storage needs to implement at least `open_file`, `open_read`, `exists`, `stat` and `remove`.
+    A storage not able to remove files sets `can_remove` to False (it cannot be used by an incremental Target) and a storage naming the files by the relative paths of the target sets `relative_paths` to True (the main_dir of its Target needs to be empty).
+    A storage able to write only one file at a time sets `single_writer` to True (the projecttopping file is then spooled while streaming, since the linked toppingfiles are stored in the meantime).
+    """
+
+    # if the files can be removed (needed by an incremental Target)
+    can_remove = True
+    # if the paths are used as they are (relative to the storage), so the main_dir of the Target needs to be empty
+    relative_paths = False
+    # if only one file can be open for writing at a time
+    single_writer = False
+
+    def make_dir(self, path: str):
+        """
+        Creates the directory (if the storage has directories).
+        """
+        pass
+
+    def open_file(self, path: str):
+        """
+        Returns a (binary) file object to write the file.
+        """
+        raise NotImplementedError
+
+    def open_read(self, path: str):
+        """
+        Returns a (binary) file object to read the file.
+        """
+        raise NotImplementedError
+
+    def write_file(
+        self,
+        path: str,
+        source_path: Union[str, ToppingFile] = None,
+        content: bytes = None,
+    ):
+        """
+        Writes the file from the source_path (or ToppingFile) or with the content (bytes).
+        """
+        with self.open_file(path) as file:
+            if isinstance(source_path, ToppingFile):
+                source_path.copy_to(file)
+            elif source_path:
+                with open(source_path, "rb") as source_file:
+                    shutil.copyfileobj(source_file, file, ToppingFile.CHUNK_SIZE)
+            else:
+                file.write(content)
+
+    def read_file(self, path: str) -> bytes:
+        with self.open_read(path) as file:
+            return file.read()
+
+    def exists(self, path: str) -> bool:
+        raise NotImplementedError
+
+    def stat(self, path: str) -> tuple:
+        """
+        Returns the size and the modification time (ns) of the file - or None if it does not exist.
+        """
+        raise NotImplementedError
+
+    def size(self, path: str) -> int:
+        return self.stat(path)[0]
+
+    def digest(self, path: str) -> str:
+        return content_digest(self.read_file(path))
+
+    def remove(self, path: str):
+        raise NotImplementedError
+
+    def flush(self):
+        """
+        Writes the pending files (e.g. the buffered puts), so `stat` returns the ones of the written files.
+        """
+        pass
+
+    def toppingfile(self, filename: str, path: str) -> ToppingFile:
+        """
+        Returns a ToppingFile of the stored file. It's not opened until the content is accessed.
+        """
+        return ToppingFile(filename, opener=lambda: self.open_read(path))
+
+    def close(self):
+        """
+        Finishes the writing (e.g. the pending puts or the archive).
+        """
+        pass
+
+
+class LocalStorage(Storage):
+    """
+    Stores the files on the local disk. This is the default storage of a Target.
+
+    The files are written atomically: To a temporary file next to the path first, that is renamed to the path when it's complete. So a file is never read half written and when many threads write the same file, the complete file of one of them is kept.
+    """
+
+    class _AtomicFile(io.BufferedWriter):
+        # writes to a temporary file and renames it to the path when it's committed (leaving the context without an exception). Closed without a commit (e.g. by a wrapper on an exception) the temporary file is removed.
+        def __init__(self, path):
+            self.path = path
+            self.temporary_path = LocalStorage._temporary_path(path)
+            self._committed = False
+            super().__init__(io.FileIO(self.temporary_path, "wb"))
+
+        def __exit__(self, exception_type, *args):
+            if not exception_type:
+                self.commit()
+            self.close()
+            return False
+
+        def commit(self):
+            """
+            Marks the file as complete, so it replaces the path when it's closed.
+            """
+            self._committed = True
+
+        def close(self):
+            if self.closed:
+                return
+            try:
+                super().close()
+            except BaseException:
+                self._committed = False
+                raise
+            finally:
+                if self._committed:
+                    os.replace(self.temporary_path, self.path)
+                elif os.path.exists(self.temporary_path):
+                    os.remove(self.temporary_path)
+
+    def make_dir(self, path: str):
+        os.makedirs(path, exist_ok=True)
+
+    def open_file(self, path: str):
+        return LocalStorage._AtomicFile(path)
+
+    def open_read(self, path: str):
+        return open(path, "rb")
+
+    def write_file(
+        self,
+        path: str,
+        source_path: Union[str, ToppingFile] = None,
+        content: bytes = None,
+    ):
+        if not source_path:
+            with self.open_file(path) as file:
+                file.write(content)
+            return
+        temporary_path = LocalStorage._temporary_path(path)
+        try:
+            if isinstance(source_path, ToppingFile):
+                source_path.save(temporary_path)
+            else:
+                shutil.copy(source_path, temporary_path)
+            os.replace(temporary_path, path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+
+    def exists(self, path: str) -> bool:
+        return os.path.exists(path)
+
+    def stat(self, path: str) -> tuple:
+        if not os.path.exists(path):
+            return None
+        file_stat = os.stat(path)
+        return file_stat.st_size, file_stat.st_mtime_ns
+
+    def digest(self, path: str) -> str:
+        return file_digest(path)
+
+    def remove(self, path: str):
+        if os.path.exists(path):
+            os.remove(path)
+
+    def toppingfile(self, filename: str, path: str) -> ToppingFile:
+        return ToppingFile(filename, path=path)
+
+    @staticmethod
+    def _temporary_path(path: str) -> str:
+        # unique per process and thread
+        return f"{path}.{os.getpid()}_{threading.get_ident()}.tmp"
+
+
+class MemoryStorage(Storage):
+    """
+    Keeps the files in memory (e.g. to return a generated topping without touching the disk). The content per path is in `files`.
+    """
+
+    class _MemoryFile(io.BytesIO):
+        # stores the content in the storage when closed
+        def __init__(self, storage, path):
+            super().__init__()
+            self.storage = storage
+            self.path = path
+
+        def close(self):
+            if not self.closed:
+                self.storage.put(self.path, self.getvalue())
+            super().close()
+
+    def __init__(self):
+        # the content of the files per path
+        self.files = {}
+        # the modification time (ns) of the files per path
+        self.mtimes = {}
+
+    def put(self, path: str, content: bytes):
+        self.files[self._key(path)] = content
+        self.mtimes[self._key(path)] = time.time_ns()
+
+    def open_file(self, path: str):
+        return MemoryStorage._MemoryFile(self, path)
+
+    def open_read(self, path: str):
+        return io.BytesIO(self.files[self._key(path)])
+
+    def write_file(
+        self,
+        path: str,
+        source_path: Union[str, ToppingFile] = None,
+        content: bytes = None,
+    ):
+        if isinstance(source_path, ToppingFile):
+            content = source_path.read()
+        elif source_path:
+            with open(source_path, "rb") as source_file:
+                content = source_file.read()
+        self.put(path, content)
+
+    def read_file(self, path: str) -> bytes:
+        return self.files[self._key(path)]
+
+    def exists(self, path: str) -> bool:
+        return self._key(path) in self.files
+
+    def stat(self, path: str) -> tuple:
+        key = self._key(path)
+        if key not in self.files:
+            return None
+        return len(self.files[key]), self.mtimes[key]
+
+    def remove(self, path: str):
+        self.files.pop(self._key(path), None)
+        self.mtimes.pop(self._key(path), None)
+
+    def _key(self, path: str) -> str:
+        return os.path.normpath(path).replace(os.sep, "/")
+
+
+class BucketStorage(MemoryStorage):
+    """
+    Stores the files as objects in a bucket. It's a local stand-in of an object store: The bucket is the directory `bucket_dir` and the key of an object is its path relative to it.
+
+    There are no directories. The puts are buffered and sent in batches of `batch_size` objects (and the rest on `close()`), like the batched uploads to an object store. The number of batches sent is counted in `batches`.
+    """
+
+    def __init__(self, bucket_dir: str, batch_size: int = 100):
+        # the files kept in memory are the pending puts
+        MemoryStorage.__init__(self)
+        self.bucket_dir = bucket_dir
+        self.batch_size = batch_size
+        self.batches = 0
+        self._lock = threading.RLock()
+
+    def put(self, path: str, content: bytes):
+        with self._lock:
+            MemoryStorage.put(self, path, content)
+            if len(self.files) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        """
+        Sends the pending puts as one batch.
+        """
+        with self._lock:
+            if not self.files:
+                return
+            for key, content in self.files.items():
+                object_path = self._object_path(key)
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                with open(object_path, "wb") as object_file:
+                    object_file.write(content)
+            self.files = {}
+            self.mtimes = {}
+            self.batches += 1
+
+    def open_read(self, path: str):
+        key = self._key(path)
+        content = self.files.get(key)
+        if content is not None:
+            return io.BytesIO(content)
+        return open(self._object_path(key), "rb")
+
+    def read_file(self, path: str) -> bytes:
+        with self.open_read(path) as file:
+            return file.read()
+
+    def exists(self, path: str) -> bool:
+        return MemoryStorage.exists(self, path) or os.path.exists(
+            self._object_path(self._key(path))
+        )
+
+    def stat(self, path: str) -> tuple:
+        key = self._key(path)
+        with self._lock:
+            if key in self.files:
+                return MemoryStorage.stat(self, path)
+        object_path = self._object_path(key)
+        if not os.path.exists(object_path):
+            return None
+        file_stat = os.stat(object_path)
+        return file_stat.st_size, file_stat.st_mtime_ns
+
+    def remove(self, path: str):
+        with self._lock:
+            MemoryStorage.remove(self, path)
+        object_path = self._object_path(self._key(path))
+        if os.path.exists(object_path):
+            os.remove(object_path)
+
+    def close(self):
+        self.flush()
+
+    def _object_path(self, key: str) -> str:
+        return os.path.join(self.bucket_dir, *key.lstrip("/").split("/"))
+
+
+class ArchiveStorage(Storage):
+    """
+    Stores the files as members of one zip archive at `archive_path`. The files are streamed one after the other into the archive and the archive is finished with `close()`.
+    When reading, only the members being accessed are decompressed.
+
+    The members are named by the paths in the target (so the main_dir of the Target needs to be empty) and they cannot be removed (so the Target cannot be incremental).
+
+    The members are written by one thread after the other (`write_file`), but since the archive is finished at the end of a generation, an archive cannot be shared by concurrent generations.
+    """
+
+    can_remove = False
+    relative_paths = True
+    # the archive has one write handle at a time
+    single_writer = True
+
+    def __init__(
+        self,
+        archive_path: str,
+        compression: int = zipfile.ZIP_DEFLATED,
+        compresslevel: int = None,
+    ):
+        self.archive_path = archive_path
+        self.compression = compression
+        self.compresslevel = compresslevel
+        # the names of the members written to the archive
+        self.members = set()
+        self._writer = None
+        self._reader = None
+        self._lock = threading.RLock()
+
+    def open_file(self, path: str):
+        archive = self._archive_writer()
+        member = self._member(path)
+        self.members.add(member)
+        return archive.open(member, "w")
+
+    def open_read(self, path: str):
+        return self._archive_reader().open(self._member(path))
+
+    def write_file(
+        self,
+        path: str,
+        source_path: Union[str, ToppingFile] = None,
+        content: bytes = None,
+    ):
+        with self._lock:
+            if self._writer and self._member(path) in self.members:
+                # a member is written once (the same toppingfile can be linked multiple times)
+                return
+            Storage.write_file(self, path, source_path, content)
+
+    def exists(self, path: str) -> bool:
+        if self._writer:
+            return self._member(path) in self.members
+        if not os.path.exists(self.archive_path):
+            return False
+        return self._member(path) in self._archive_reader().NameToInfo
+
+    def stat(self, path: str) -> tuple:
+        if not self.exists(path):
+            return None
+        archive = self._writer or self._archive_reader()
+        # the modification time of the members is not precise enough to be used
+        return archive.getinfo(self._member(path)).file_size, None
+
+    def close(self):
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+        if self._reader:
+            self._reader.close()
+            self._reader = None
+
+    def _member(self, path: str) -> str:
+        return path.replace(os.sep, "/")
+
+    def _archive_writer(self) -> zipfile.ZipFile:
+        if not self._writer:
+            if self._reader:
+                self._reader.close()
+                self._reader = None
+            archive_dir = os.path.dirname(self.archive_path)
+            if archive_dir:
+                os.makedirs(archive_dir, exist_ok=True)
+            self.members = set()
+            self._writer = zipfile.ZipFile(
+                self.archive_path,
+                "w",
+                compression=self.compression,
+                compresslevel=self.compresslevel,
+            )
+        return self._writer
+
+    def _archive_reader(self) -> zipfile.ZipFile:
+        if not self._reader:
+            # a written archive is finished before reading it
+            if self._writer:
+                self._writer.close()
+                self._writer = None
+            self._reader = zipfile.ZipFile(self.archive_path, "r")
+        return self._reader
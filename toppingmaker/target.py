@@ -16,10 +16,14 @@
  *                                                                         *
  ***************************************************************************/
 """
+import json
 import os
-import shutil
+import threading
+from typing import Union
 
-from .utils import slugify
+from .storage import LocalStorage, Storage
+from .toppingfile import ToppingFile
+from .utils import content_digest, file_digest, slugify
 
 
 class Target:
@@ -46,46 +50,274 @@ class Target:
     │  │  └── <projectname>_<layername>.qml
     │  └── layerdefinition
     │  │  └── <projectname>_<layername>.qlr
+
+    With `deduplicate` the toppingfiles are content addressed: A toppingfile with the same content as an already stored one (of the same type) is not stored again and its link points to the already stored file.
+
+    With `incremental` a manifest (<projectname>_manifest.json) containing the hash, size and mtime of every stored file is kept next to the projecttopping folder.
+    Files with the same content as the one already in the target are skipped and files not stored anymore are removed. See `write_manifest`.
+
+    The directories are created once and memoized per type for the lifetime of the target.
+
+    The files are written and read through the `storage` (by default a LocalStorage writing to the disk). See `storage.Storage` for the other storages (e.g. in memory).
+
+    Targets with the same main_dir can be used by many threads at once (e.g. `ProjectTopping.generate_files_concurrently`), but a target is used by one generation at a time, since a generation writes its projecttopping file and manifest. The registration of the toppingfiles (`toppingfileinfo_list`, the deduplicated links and the manifest) is done with the `lock` and the LocalStorage writes the files atomically. A custom path_resolver should use the `lock` as well when it registers the toppingfiles.
     """
 
+    MANIFEST_SUFFIX = "_manifest.json"
+
     def __init__(
         self,
         projectname: str = "project",
         main_dir: str = None,
         sub_dir: str = None,
         path_resolver=None,
+        deduplicate: bool = False,
+        incremental: bool = False,
+        storage: Storage = None,
     ):
         self.projectname = projectname
-        self.main_dir = main_dir
+        self.main_dir = main_dir or ""
         self.sub_dir = sub_dir
         self.path_resolver = path_resolver
+        self.deduplicate = deduplicate
+        self.incremental = incremental
+        self.storage = storage or LocalStorage()
+
+        if self.incremental and not self.storage.can_remove:
+            raise ValueError(
+                "An incremental target needs a storage able to remove files ({} cannot).".format(
+                    type(self.storage).__name__
+                )
+            )
+        if self.main_dir and self.storage.relative_paths:
+            raise ValueError(
+                "The files of a {} are named by their relative path, so the main_dir needs to be empty (not {}).".format(
+                    type(self.storage).__name__, self.main_dir
+                )
+            )
 
         if not path_resolver:
             self.path_resolver = self.default_path_resolver
 
         self.toppingfileinfo_list = []
+        # the links of the stored toppingfiles per type and content digest (only used with deduplicate)
+        self.deduplicated_links = {}
+        # the manifest entries of the previous and the current generation (only used with incremental)
+        self.previous_manifest = None
+        self.manifest = {}
+        # the relative paths of the written, skipped and removed files (only used with incremental)
+        self.manifest_report = {"written": [], "skipped": [], "removed": []}
+        # the absolute and relative paths of the created directories per type
+        self._filedir_paths = {}
+        # synchronizes the registration of the toppingfiles when used by many threads
+        self.lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
 
     def filedir_path(self, file_dir):
-        relative_path = os.path.join(self.sub_dir, file_dir)
-        absolute_path = os.path.join(self.main_dir, relative_path)
-        if not os.path.exists(absolute_path):
-            os.makedirs(absolute_path)
-        return absolute_path, relative_path
-
-    def toppingfile_link(self, type: str, path: str):
-        filename_slug = f"{slugify(self.projectname)}_{os.path.basename(path)}"
+        filedir_path = self._filedir_paths.get(file_dir)
+        if not filedir_path:
+            with self.lock:
+                filedir_path = self._filedir_paths.get(file_dir)
+                if not filedir_path:
+                    relative_path = os.path.join(self.sub_dir, file_dir)
+                    absolute_path = os.path.join(self.main_dir, relative_path)
+                    self.storage.make_dir(absolute_path)
+                    filedir_path = self._filedir_paths[file_dir] = (
+                        absolute_path,
+                        relative_path,
+                    )
+        return filedir_path
+
+    def make_filedirs(self, file_dirs: list):
+        """
+        Creates the directories of the types at once (the ones already created are skipped).
+        """
+        for file_dir in file_dirs:
+            self.filedir_path(file_dir)
+
+    def open_file(self, absolute_path: str):
+        """
+        Returns a (binary) file object to write the file at the absolute_path in the storage.
+        """
+        return self.storage.open_file(absolute_path)
+
+    def read_file(self, absolute_path: str) -> bytes:
+        """
+        Returns the content of the file at the absolute_path in the storage.
+        """
+        return self.storage.read_file(absolute_path)
+
+    def file_exists(self, absolute_path: str) -> bool:
+        return self.storage.exists(absolute_path)
+
+    def file_size(self, absolute_path: str) -> int:
+        return self.storage.size(absolute_path)
+
+    def close(self):
+        """
+        Finishes the writing of the generated files in the storage.
+        """
+        self.storage.close()
+
+    def toppingfile_link(self, type: str, path: Union[str, ToppingFile]):
+        """
+        Stores the toppingfile (from the path or the ToppingFile) in the target and returns the link according to the path_resolver.
+        """
+        if self.deduplicate:
+            key = (type, self._source_digest(path))
+            with self.lock:
+                if key not in self.deduplicated_links:
+                    self.deduplicated_links[key] = self._store_toppingfile(type, path)
+                return self.deduplicated_links[key]
+        return self._store_toppingfile(type, path)
+
+    def toppingfile_links(self, toppingfiles: list) -> list:
+        """
+        Stores many toppingfiles in one pass and returns their links (in the same order).
+        The toppingfiles are passed as (type, path or ToppingFile) tuples. The directories of all the types are created first.
+        """
+        self.make_filedirs(dict.fromkeys(type for type, _ in toppingfiles))
+        return [self.toppingfile_link(type, path) for type, path in toppingfiles]
+
+    def _store_toppingfile(self, type: str, path: Union[str, ToppingFile]):
+        filename = path.filename if isinstance(path, ToppingFile) else path
+        filename_slug = f"{slugify(self.projectname)}_{os.path.basename(filename)}"
         absolute_filedir_path, relative_filedir_path = self.filedir_path(type)
-        shutil.copy(
-            path,
-            os.path.join(absolute_filedir_path, filename_slug),
-        )
+        self.store_file(os.path.join(absolute_filedir_path, filename_slug), path)
         return self.path_resolver(self, filename_slug, type)
 
+    def store_file(
+        self,
+        absolute_path: str,
+        source_path: Union[str, ToppingFile] = None,
+        content=None,
+    ):
+        """
+        Stores the file from the source_path (or ToppingFile) or with the content (bytes) to the absolute_path.
+        With incremental the file is only written when the content differs from the file already in the target.
+        """
+        if not self.incremental:
+            self._write_file(absolute_path, source_path, content)
+            return True
+
+        relative_path = os.path.relpath(absolute_path, self.main_dir)
+        digest = (
+            self._source_digest(source_path) if source_path else content_digest(content)
+        )
+        with self.lock:
+            if self.previous_manifest is None:
+                self._start_generation()
+
+            if relative_path in self.manifest:
+                # already stored in this generation
+                written = self.manifest[relative_path]["sha256"] != digest
+            else:
+                written = digest != self._stored_digest(absolute_path, relative_path)
+
+            if written:
+                self._write_file(absolute_path, source_path, content)
+            if relative_path not in self.manifest:
+                self.manifest_report["written" if written else "skipped"].append(
+                    relative_path
+                )
+            # the size and the mtime are recorded in write_manifest (when the files are written in the storage)
+            self.manifest[relative_path] = {"sha256": digest}
+        return written
+
+    def _write_file(self, absolute_path, source_path=None, content=None):
+        self.storage.write_file(absolute_path, source_path, content)
+
+    def _source_digest(self, source_path: Union[str, ToppingFile]):
+        if isinstance(source_path, ToppingFile):
+            return source_path.digest()
+        return file_digest(source_path)
+
+    def write_manifest(self):
+        """
+        Removes the files of the previous generation, that have not been stored in the current one, and writes the manifest.
+        Returns the manifest_report with the written, skipped and removed files. It's kept until the next generation starts.
+        """
+        with self.lock:
+            if self.previous_manifest is None:
+                self._start_generation()
+
+            for relative_path in self.previous_manifest.keys():
+                if relative_path not in self.manifest:
+                    self.storage.remove(os.path.join(self.main_dir, relative_path))
+                    self.manifest_report["removed"].append(relative_path)
+
+            # the size and the mtime of the files written in the storage (e.g. not of the pending puts)
+            self.storage.flush()
+            for relative_path, entry in self.manifest.items():
+                entry["size"], entry["mtime"] = self.storage.stat(
+                    os.path.join(self.main_dir, relative_path)
+                )
+
+            manifest_path = self._manifest_path()
+            self.storage.make_dir(os.path.dirname(manifest_path))
+            self.storage.write_file(
+                manifest_path,
+                content=json.dumps(self.manifest, indent=2, sort_keys=True).encode(
+                    "utf-8"
+                ),
+            )
+
+            self.previous_manifest = None
+            self.manifest = {}
+            self.deduplicated_links = {}
+            return self.manifest_report
+
+    def _start_generation(self):
+        self.previous_manifest = self._read_manifest()
+        self.manifest = {}
+        self.manifest_report = {"written": [], "skipped": [], "removed": []}
+
+    def _manifest_path(self):
+        return os.path.join(
+            self.main_dir,
+            self.sub_dir or "",
+            f"{slugify(self.projectname)}{Target.MANIFEST_SUFFIX}",
+        )
+
+    def _read_manifest(self):
+        manifest_path = self._manifest_path()
+        if not self.storage.exists(manifest_path):
+            return {}
+        return json.loads(self.storage.read_file(manifest_path).decode("utf-8"))
+
+    def _stored_digest(self, absolute_path, relative_path):
+        # the digest of the file already in the target - read from the manifest if the file has not been touched since
+        file_stat = self.storage.stat(absolute_path)
+        if not file_stat:
+            return None
+        entry = self.previous_manifest.get(relative_path)
+        if entry and (entry["size"], entry["mtime"]) == file_stat:
+            return entry["sha256"]
+        return self.storage.digest(absolute_path)
+
+    def linked_toppingfile(self, link: str) -> ToppingFile:
+        """
+        Returns a ToppingFile of the file linked in the projecttopping (e.g. <subdir>/layerstyle/<projectname>_<layername>.qml).
+        The file is not opened until the content is accessed. The filename is the one without the projectname (<layername>.qml), like it has been before storing it.
+        """
+        filename = os.path.basename(link)
+        projectname_prefix = f"{slugify(self.projectname)}_"
+        if filename.startswith(projectname_prefix):
+            filename = filename[len(projectname_prefix) :]
+        return self.storage.toppingfile(filename, os.path.join(self.main_dir, link))
+
     @staticmethod
     def default_path_resolver(target, name, type):
         _, relative_filedir_path = target.filedir_path(type)
 
         toppingfile = {"path": os.path.join(relative_filedir_path, name), "type": type}
-        target.toppingfileinfo_list.append(toppingfile)
+        with target.lock:
+            target.toppingfileinfo_list.append(toppingfile)
 
         return os.path.join(relative_filedir_path, name)
@@ -0,0 +1,80 @@
+"""
+/***************************************************************************
+                              -------------------
+        begin                : 2022-07-17
+        git sha              : :%H$
+        copyright            : (C) 2022 by Dave Signer
+        email                : david at opengis ch
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import os
+import shutil
+import tempfile
+import weakref
+
+from .utils import SlugRegistry
+
+
+class TemporaryStorage:
+    """
+    The temporary directory of the toppingfiles (styles, definitions and layout templates) between parsing a project and generating the files.
+
+    The directory is created once when the first path is requested, so the files are written without checking or creating their directory.
+    All the requested paths are tracked in `paths` and the filenames are made unique with the `slug_registry`. The directory is removed with `cleanup()`, when leaving the context (`with TemporaryStorage() as storage:`) or at the latest when the storage is garbage collected.
+    """
+
+    def __init__(self, prefix: str = "toppingmaker_temporary_files_"):
+        self.prefix = prefix
+        # the paths of the temporary files
+        self.paths = set()
+        # the unique filenames of the temporary files
+        self.slug_registry = SlugRegistry()
+        self._directory = None
+        self._finalizer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cleanup()
+        return False
+
+    @property
+    def directory(self) -> str:
+        """
+        The temporary directory (created on first access).
+        """
+        if not self._directory:
+            self._directory = tempfile.mkdtemp(prefix=self.prefix)
+            self._finalizer = weakref.finalize(
+                self, shutil.rmtree, self._directory, True
+            )
+        return self._directory
+
+    def path(self, filename: str) -> str:
+        """
+        Returns the path of the temporary file with the filename and tracks it.
+        """
+        path = os.path.join(self.directory, filename)
+        self.paths.add(path)
+        return path
+
+    def cleanup(self):
+        """
+        Removes the directory with all the temporary files. A new directory is created when a path is requested again.
+        """
+        if self._finalizer:
+            self._finalizer()
+            self._finalizer = None
+        self._directory = None
+        self.paths = set()
+        self.slug_registry = SlugRegistry()
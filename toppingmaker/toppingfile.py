@@ -0,0 +1,142 @@
+"""
+/***************************************************************************
+                              -------------------
+        begin                : 2022-07-17
+        git sha              : :%H$
+        copyright            : (C) 2022 by Dave Signer
+        email                : david at opengis ch
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import hashlib
+import shutil
+import tempfile
+
+from .utils import file_digest
+
+
+class ToppingFile:
+    """
+    The content of a toppingfile (style, definition or layout template) kept until it's stored in the target.
+
+    The content is kept in memory. When it's bigger than `max_memory_size` it's spooled to a temporary file on disk.
+    This way the content is written only once - directly to the target.
+
+    A ToppingFile can link an existing file with `path` (e.g. when loaded from a target) or with `opener` (a function returning a binary file object, e.g. of an archive member). The file is only opened when the content is accessed.
+    """
+
+    # a toppingfile is linked per node when loading a topping, so it's kept small
+    __slots__ = ("filename", "max_memory_size", "path", "opener", "_buffer")
+
+    # default limit of the content kept in memory per toppingfile
+    MAX_MEMORY_SIZE = 8 * 1024 * 1024
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(
+        self,
+        filename: str,
+        max_memory_size: int = MAX_MEMORY_SIZE,
+        path: str = None,
+        opener=None,
+    ):
+        # the name of the file (e.g. <layername>.qml) used to create the name in the target
+        self.filename = filename
+        self.max_memory_size = max_memory_size
+        # the linked file the content is read from as long as no content has been written
+        self.path = path
+        # the function opening the linked content if it's not a file (e.g. an archive member)
+        self.opener = opener
+        self._buffer = None
+
+    def __repr__(self):
+        return f"ToppingFile({self.path or self.filename})"
+
+    def write(self, content: bytes):
+        """
+        Sets the content (replaces the existing one).
+        """
+        buffer = tempfile.SpooledTemporaryFile(
+            max_size=self.max_memory_size, prefix="toppingmaker_"
+        )
+        buffer.write(content)
+        if self._buffer:
+            self._buffer.close()
+        self._buffer = buffer
+
+    def read(self) -> bytes:
+        """
+        Returns the whole content.
+        """
+        if not self._buffer:
+            if self._linked():
+                with self._open_linked() as file:
+                    return file.read()
+            return b""
+        self._buffer.seek(0)
+        return self._buffer.read()
+
+    def save(self, path: str):
+        """
+        Writes the content to the file at path.
+        """
+        if not self._buffer and self.path and not self.opener:
+            try:
+                shutil.copyfile(self.path, path)
+            except shutil.SameFileError:
+                # stored to the file it's linked to
+                pass
+            return
+        with open(path, "wb") as file:
+            self.copy_to(file)
+
+    def copy_to(self, stream):
+        """
+        Writes the content to the (binary) stream in chunks.
+        """
+        if self._buffer:
+            self._buffer.seek(0)
+            shutil.copyfileobj(self._buffer, stream, ToppingFile.CHUNK_SIZE)
+        elif self._linked():
+            with self._open_linked() as file:
+                shutil.copyfileobj(file, stream, ToppingFile.CHUNK_SIZE)
+
+    def digest(self) -> str:
+        """
+        Returns the sha256 hex digest of the content.
+        """
+        if not self._buffer and self.path and not self.opener:
+            return file_digest(self.path)
+        digest = hashlib.sha256()
+        if self._buffer:
+            self._buffer.seek(0)
+            for chunk in iter(lambda: self._buffer.read(ToppingFile.CHUNK_SIZE), b""):
+                digest.update(chunk)
+        elif self._linked():
+            with self._open_linked() as file:
+                for chunk in iter(lambda: file.read(ToppingFile.CHUNK_SIZE), b""):
+                    digest.update(chunk)
+        return digest.hexdigest()
+
+    def close(self):
+        """
+        Releases the content (and the spooled file).
+        """
+        if self._buffer:
+            self._buffer.close()
+            self._buffer = None
+
+    def _linked(self) -> bool:
+        return bool(self.opener or self.path)
+
+    def _open_linked(self):
+        if self.opener:
+            return self.opener()
+        return open(self.path, "rb")
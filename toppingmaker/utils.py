@@ -16,15 +16,108 @@
  *                                                                         *
  ***************************************************************************/
 """
+import functools
+import hashlib
 import re
 import unicodedata
 
+NON_ALPHANUMERIC_PATTERN = re.compile(r"[^a-zA-Z0-9]+")
+HYPHENS_PATTERN = re.compile(r"[-]+")
 
+
+@functools.lru_cache(maxsize=4096)
 def slugify(text: str) -> str:
+    # memoized, since the same names are slugified for every toppingfile and link
     if not text:
         return text
     slug = unicodedata.normalize("NFKD", text)
-    slug = re.sub(r"[^a-zA-Z0-9]+", "_", slug).strip("_")
-    slug = re.sub(r"[-]+", "_", slug)
+    slug = NON_ALPHANUMERIC_PATTERN.sub("_", slug).strip("_")
+    slug = HYPHENS_PATTERN.sub("_", slug)
     slug = slug.lower()
     return slug
+
+
+def group_path(node=None) -> str:
+    """
+    Returns the names of the parent groups of the layertree node (without the root) joined by "/" - None if there is no node.
+    """
+    if not node:
+        return None
+    names = []
+    parent = node.parent()
+    while parent and parent.parent():
+        names.insert(0, parent.name())
+        parent = parent.parent()
+    return "/".join(names)
+
+
+class SlugRegistry:
+    """
+    Assigns unique slugs (e.g. the filenames of the toppingfiles) to keys identifying what they are made of (e.g. a layer and its style).
+
+    The same key gets always the same slug. If the slug is ambiguous - reserved (see `reserve`) or already registered for another key (e.g. two layers with the same name in different groups) - it's prefixed with the qualifier (e.g. the group path) and if it's still not unique numbered.
+    When all the keys are reserved before (e.g. of all the layers of the project), the slug of a key does not depend on the order the keys are registered in. Only keys with the same slug and qualifier are numbered in the order they are registered.
+    """
+
+    def __init__(self):
+        # the slug per key
+        self.slugs = {}
+        # the key per slug
+        self.keys = {}
+        # the reserved keys per slug
+        self.reserved = {}
+
+    def reserve(self, key, slug: str, suffix: str = ""):
+        """
+        Reserves the slug (with the suffix) for the key, so it's known to be ambiguous before the keys are registered.
+        """
+        self.reserved.setdefault(f"{slug}{suffix}", set()).add(key)
+
+    def unique_slug(self, key, slug: str, qualifier=None, suffix: str = "") -> str:
+        """
+        Returns the slug (with the suffix, e.g. the file extension) registered for the key.
+        The qualifier is a slug or a function returning it. It's only used when the slug is ambiguous.
+        """
+        unique_slug = self.slugs.get(key)
+        if unique_slug:
+            return unique_slug
+
+        candidate = slug
+        if self._ambiguous(key, f"{candidate}{suffix}") and qualifier:
+            qualifier_slug = qualifier() if callable(qualifier) else qualifier
+            if qualifier_slug:
+                candidate = f"{qualifier_slug}_{slug}"
+        if f"{candidate}{suffix}" in self.keys:
+            number = 2
+            while f"{candidate}_{number}{suffix}" in self.keys:
+                number += 1
+            candidate = f"{candidate}_{number}"
+
+        unique_slug = f"{candidate}{suffix}"
+        self.slugs[key] = unique_slug
+        self.keys[unique_slug] = key
+        return unique_slug
+
+    def _ambiguous(self, key, slug: str) -> bool:
+        if slug in self.keys:
+            return True
+        reserved_keys = self.reserved.get(slug)
+        return bool(reserved_keys) and bool(reserved_keys - {key})
+
+
+def content_digest(content: bytes) -> str:
+    """
+    Returns the sha256 hex digest of the content.
+    """
+    return hashlib.sha256(content).hexdigest()
+
+
+def file_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Returns the sha256 hex digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()